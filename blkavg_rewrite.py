@@ -4,12 +4,30 @@ Python implementation of IRAF `blkavg` task.
 Examples
 --------
 >>> import blkavg_rewrite
->>> blkavg_rewrite.test()
+>>> blkavg_rewrite.benchmark()
+>>> blkavg_rewrite.test_blkrep()
+
+Bin a large FITS image without loading it all into memory:
+
+>>> blkavg_rewrite.blkavg_fits('mosaic_drz.fits', 'mosaic_blk.fits', (4, 4),
+...                            ext=1)
+
+>>> import numpy as np
+>>> a = np.arange(35, dtype=float).reshape(5, 7)
+>>> blkavg_rewrite.blkreduce(a, (2, 3), func='median')
+array([[ 4.5,  7.5,  9.5],
+       [18.5, 21.5, 23.5],
+       [29. , 32. , 34. ]])
 
 """
 
 from __future__ import division, print_function
 
+import functools
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 from numpy.lib.stride_tricks import as_strided
 
@@ -20,7 +38,7 @@ def blkavg2d(in_arr, blockshape):
 
     .. notes::
 
-        #. This is the slow version.
+        #. This is the slow version. Use :func:`blkreduce` instead.
         #. Only works when array is even divided by block size.
 
     Parameters
@@ -46,8 +64,8 @@ def blkavg2d(in_arr, blockshape):
     yblock, xblock = blockshape
 
     # Calculate new dimensions
-    x_bin = in_arr.shape[1] / xblock
-    y_bin = in_arr.shape[0] / yblock
+    x_bin = in_arr.shape[1] // xblock
+    y_bin = in_arr.shape[0] // yblock
     out_arr = np.zeros((y_bin, x_bin))
 
     # Average each block
@@ -60,17 +78,244 @@ def blkavg2d(in_arr, blockshape):
     return out_arr
 
 
+def blkreduce(array, blockshape, func='mean', edge='partial', sigma=3.0,
+              maxiters=5, slab_bytes=2**24):
+    """
+    Block reduce N-D array without Python loops over blocks.
+
+    Each region of the array (the evenly divisible core and, if any,
+    the remainders at the far edge of each axis) is viewed as
+    ``nblocks + blocks`` with strides, i.e., a reshape that never
+    copies, even for non-contiguous or memory-mapped input.
+    The reduction is done over the block axes, a slab of blocks
+    along the first axis at a time to bound temporary memory.
+
+    Parameters
+    ----------
+    array : array_like
+        N-D input array. Can be `numpy.memmap`.
+
+    blockshape : tuple of int
+        Blocking factors for each axis. Missing trailing axes
+        are not blocked.
+
+    func : {'mean', 'sum', 'median', 'clipmean'}
+        Reduction for each block. ``'clipmean'`` is the iterative
+        sigma-clipped mean that ignores NaN.
+
+    edge : {'partial', 'trim'}
+        What to do with remainders when an axis is not evenly divided:
+
+        * ``'partial'``: Reduce the smaller blocks at the edge,
+          like IRAF `blkavg`.
+        * ``'trim'``: Drop them.
+
+    sigma : float
+        Clipping threshold in standard deviations for ``'clipmean'``.
+
+    maxiters : int
+        Maximum clipping iterations for ``'clipmean'``.
+
+    slab_bytes : int
+        Approximate size of input processed at once.
+
+    Returns
+    -------
+    out_arr : array_like
+        Block reduced array with smaller size.
+
+    """
+    array = np.asarray(array)
+    blockshape = _full_blockshape(blockshape, array.ndim)
+
+    if func not in _REDUCERS:
+        raise ValueError('func must be one of {} but got {}'.format(
+            sorted(_REDUCERS), func))
+    if edge not in ('partial', 'trim'):
+        raise ValueError("edge must be 'partial' or 'trim' but got "
+                         "{}".format(edge))
+
+    # Possible regions for each axis: (input slice, nblocks, block size,
+    # output slice)
+    regions_by_axis = []
+    out_shape = []
+    for n, b in zip(array.shape, blockshape):
+        nfull, rem = divmod(n, b)
+        regions = []
+        if nfull > 0:
+            regions.append((slice(0, nfull * b), nfull, b, slice(0, nfull)))
+        if rem > 0 and edge == 'partial':
+            regions.append((slice(nfull * b, n), 1, rem,
+                            slice(nfull, nfull + 1)))
+            nfull += 1
+        regions_by_axis.append(regions)
+        out_shape.append(nfull)
+
+    out_arr = None
+    for region in itertools.product(*regions_by_axis):
+        in_slc, nblocks, blocks, out_slc = zip(*region)
+        res = _reduce_region(array[in_slc], nblocks, blocks, func,
+                             sigma=sigma, maxiters=maxiters,
+                             slab_bytes=slab_bytes)
+        if out_arr is None:
+            out_arr = np.empty(out_shape, dtype=res.dtype)
+        out_arr[out_slc] = res
+
+    if out_arr is None:  # Nothing to reduce
+        out_arr = np.empty(out_shape, dtype=_reduced_dtype(array.dtype, func))
+
+    return out_arr
+
+
+def blkreduce_parallel(array, blockshape, func='mean', edge='partial',
+                       max_workers=None, tile_bytes=2**24, sigma=3.0,
+                       maxiters=5):
+    """
+    Like :func:`blkreduce` but reduce tiles in parallel.
+
+    A Numpy array (or memmap) is split into tiles of whole rows of
+    blocks along the first axis, which are reduced in a thread pool
+    (Numpy releases the GIL while reducing) into one output array.
+    A `dask.array.Array` has its chunks aligned to the blocking
+    factors (rechunking only if needed) and is reduced chunk by chunk
+    with ``map_blocks``. Either way, the result is the same as
+    :func:`blkreduce`.
+
+    Parameters
+    ----------
+    array : array_like or `dask.array.Array`
+        N-D input array.
+
+    blockshape, func, edge, sigma, maxiters
+        See :func:`blkreduce`.
+
+    max_workers : int or `None`
+        Number of threads for Numpy input.
+        See `concurrent.futures.ThreadPoolExecutor`.
+
+    tile_bytes : int
+        Approximate size of input tile for Numpy input.
+
+    Returns
+    -------
+    out_arr : array_like or `dask.array.Array`
+        Block reduced array. Lazy if input is from Dask;
+        call its ``compute`` method to get the values.
+
+    """
+    kwargs = {'func': func, 'edge': edge, 'sigma': sigma,
+              'maxiters': maxiters}
+
+    if _is_dask_array(array):
+        return _blkreduce_dask(array, blockshape, **kwargs)
+
+    array = np.asarray(array)
+    blockshape = _full_blockshape(blockshape, array.ndim)
+    out_arr = np.empty(_blocked_shape(array.shape, blockshape, edge=edge),
+                       dtype=_reduced_dtype(array.dtype, func))
+    if out_arr.size == 0:
+        return out_arr
+
+    yblock = blockshape[0]
+    nrows = array.shape[0]
+    if edge == 'trim':
+        nrows -= nrows % yblock
+
+    # Enough tiles to keep all the threads busy.
+    if max_workers is None:
+        max_workers = min(32, (os.cpu_count() or 1) + 4)
+    row_bytes = array.itemsize * int(np.prod(array.shape[1:]))
+    nblock_rows = max(min(tile_bytes // (yblock * row_bytes),
+                          -(-out_arr.shape[0] // (4 * max_workers))), 1)
+    tile_rows = yblock * nblock_rows
+
+    def reduce_tile(y1):
+        y2 = min(y1 + tile_rows, nrows)
+        j1 = y1 // yblock
+        out_arr[j1:j1 + nblock_rows] = blkreduce(
+            array[y1:y2], blockshape, **kwargs)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # list() to re-raise any exception from the threads.
+        list(executor.map(reduce_tile, range(0, nrows, tile_rows)))
+
+    return out_arr
+
+
 # Written by Erik Bray using codes from
 # https://svn.stsci.edu/trac/ssb/stsci_python/browser/stsci.image/branches/blkavg-rewrite/stsci/image/_image.py
 
 
 def blkavg(array, blockshape):
-    blocks = blockview(array, blockshape)
-    axes = range(len(blocks.shape) - 1,
-                 len(blocks.shape) - len(array.shape) - 1, -1)
-    means = np.apply_over_axes(np.mean, blocks, axes)
-    # Drop the extra dimensions
-    return means.reshape(blocks.shape[:len(array.shape)])[:-1, :-1]
+    """
+    Block average, dropping incomplete blocks at the edges.
+
+    See :func:`blkreduce` for more options.
+
+    """
+    return blkreduce(array, blockshape, func='mean', edge='trim')
+
+
+def blkrep(array, blockshape, materialize=False, out=None):
+    """
+    Block replicate, like IRAF `blkrep`; the inverse of :func:`blkavg`.
+
+    Parameters
+    ----------
+    array : array_like
+        N-D input array.
+
+    blockshape : tuple of int
+        Replication factors for each axis. Missing trailing axes
+        are not replicated.
+
+    materialize : bool
+        If `False`, return a read-only broadcast view that takes no
+        extra memory, with shape ``array.shape + blockshape`` (the same
+        layout as :func:`blockview`, so they can be combined directly).
+        If `True`, return a new array with shape
+        ``array.shape * blockshape``.
+
+    out : array_like or `None`
+        Array with shape ``array.shape * blockshape`` to write the
+        materialized result into, e.g., a memmap. Implies
+        ``materialize=True``.
+
+    Returns
+    -------
+    out_arr : array_like
+        Block replicated array or view.
+
+    Examples
+    --------
+    Divide an image by a flat field at 4x coarser resolution without
+    making an upsampled copy of the flat:
+
+    >>> out = np.empty_like(image)
+    >>> np.divide(blockview(image, (4, 4)), blkrep(flat, (4, 4)),
+    ...           out=blockview(out, (4, 4)))
+
+    """
+    array = np.asarray(array)
+    blockshape = _full_blockshape(blockshape, array.ndim)
+    ndim = array.ndim
+
+    # Adding unit axes is always a view, so is broadcasting.
+    view = np.broadcast_to(array.reshape(array.shape + (1, ) * ndim),
+                           array.shape + blockshape)
+
+    if out is None and not materialize:
+        return view
+
+    out_shape = tuple(n * b for n, b in zip(array.shape, blockshape))
+    if out is None:
+        out = np.empty(out_shape, dtype=array.dtype)
+    elif out.shape != out_shape:
+        raise ValueError('out must have shape {} but got {}'.format(
+            out_shape, out.shape))
+
+    _blocked_view(out, array.shape, blockshape, writeable=True)[...] = view
+    return out
 
 
 def blockview(array, blocks):
@@ -83,7 +328,7 @@ def blockview(array, blocks):
                          'input array')
 
     original_shape = array.shape
-    expanded_shape = tuple(a + b - (a % b)
+    expanded_shape = tuple(a + (-a % b)
                            for a, b in zip(original_shape, blocks))
     if expanded_shape != original_shape:
         # We have to make a new expanded array that can be evenly divided by
@@ -95,13 +340,9 @@ def blockview(array, blocks):
         array = new_array
 
     # Number of blocks in each axis
-    nblocks = tuple(array.shape[n] / blocks[n] for n in range(len(blocks)))
+    nblocks = tuple(array.shape[n] // blocks[n] for n in range(len(blocks)))
 
-    shape = nblocks + blocks
-    strides = (tuple(array.strides[n] * blocks[n]
-               for n in range(len(blocks))) + array.strides)
-
-    blocked = as_strided(array, shape, strides)
+    blocked = _blocked_view(array, nblocks, blocks, writeable=True)
 
     if original_shape != expanded_shape:
         return np.ma.masked_invalid(blocked)
@@ -109,36 +350,328 @@ def blockview(array, blocks):
         return blocked
 
 
-def test():
-    import matplotlib.pyplot as plt
-    import time
+def blkavg_fits(infile, outfile, blockshape, ext=0, func='mean',
+                edge='partial', strip_bytes=2**26, overwrite=False,
+                sigma=3.0, maxiters=5):
+    """
+    Block reduce a FITS image in strips and stream out the result.
+
+    The input is read with memory mapping, a strip of whole blocks
+    along the slowest-varying axis at a time, so peak memory is about
+    one strip no matter how large the image is. Each reduced strip is
+    written to a new FITS file right away using
+    `~astropy.io.fits.StreamingHDU`.
+
+    Parameters
+    ----------
+    infile, outfile : str
+        Input and output FITS filenames. Output has the result
+        in its primary HDU.
+
+    blockshape : tuple of int
+        Blocking factors in Numpy order, e.g., ``(ny, nx)``.
+
+    ext : int or str
+        Input image extension.
+
+    func, edge, sigma, maxiters
+        See :func:`blkreduce`.
+
+    strip_bytes : int
+        Approximate size of input strip to read at once.
+        A strip is at least one row of blocks.
+
+    overwrite : bool
+        Overwrite existing output file.
+
+    """
+    from astropy.io import fits
+
+    if os.path.exists(outfile):
+        if not overwrite:
+            raise OSError('{} already exists'.format(outfile))
+        os.remove(outfile)
+
+    with fits.open(infile) as pf:
+        hdu = pf[ext]
+        shape = hdu.shape
+        blockshape = _full_blockshape(blockshape, len(shape))
+        section = hdu.section
+        in_hdr = hdu.header
+
+        yblock = blockshape[0]
+        itemsize = abs(in_hdr['BITPIX']) // 8
+        row_bytes = itemsize * int(np.prod(shape[1:]))
+        strip_rows = yblock * max(strip_bytes // (yblock * row_bytes), 1)
+
+        if edge == 'trim':
+            nrows = shape[0] - shape[0] % yblock
+        else:
+            nrows = shape[0]
+
+        shdu = None
+        try:
+            for y1 in range(0, nrows, strip_rows):
+                y2 = min(y1 + strip_rows, nrows)
+                out_strip = blkreduce(section[y1:y2], blockshape, func=func,
+                                      edge=edge, sigma=sigma,
+                                      maxiters=maxiters)
+
+                if shdu is None:  # Now we know the output dtype
+                    out_shape = _blocked_shape(shape, blockshape, edge)
+                    out_hdr = _blocked_header(
+                        in_hdr, out_shape, out_strip.dtype, blockshape)
+                    out_hdr.add_history('{} blocked by {} with {} {}'.format(
+                        os.path.basename(infile),
+                        'x'.join(map(str, blockshape[::-1])), func, edge))
+                    shdu = fits.StreamingHDU(outfile, out_hdr)
+
+                shdu.write(out_strip)
+        finally:
+            if shdu is not None:
+                shdu.close()
+
+
+def benchmark(shape=(2046, 2070), blockshape=(6, 6), repeat=3, doplot=False):
+    """
+    Time block averaging implementations on the same array.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Shape of test array. It is trimmed to a multiple of `blockshape`,
+        which :func:`blkavg2d` needs.
+
+    blockshape : tuple of int
+        Blocking factors.
+
+    repeat : int
+        Best of this many runs is reported.
+
+    doplot : bool
+        Plot the input and the block averaged result.
+
+    Returns
+    -------
+    timings : dict
+        Best time in seconds for each implementation.
+
+    """
+    import timeit
+
+    shape = tuple(n - n % k for n, k in zip(shape, blockshape))
+    if min(shape) < 1:
+        raise ValueError('shape must be at least blockshape {} in each '
+                         'dimension'.format(blockshape))
+    a = np.arange(np.prod(shape), dtype=float).reshape(shape)
 
-    naxis1 = 2070
-    naxis2 = 2046
-    blockshape = (6, 6)
+    # Reference: blockview + apply_over_axes as originally written.
+    def legacy_blkavg():
+        blocks = blockview(a, blockshape)
+        axes = range(blocks.ndim - 1, blocks.ndim - a.ndim - 1, -1)
+        means = np.apply_over_axes(np.mean, blocks, axes)
+        return means.reshape(blocks.shape[:a.ndim])
 
-    a = np.arange(naxis1 * naxis2).reshape(naxis2, naxis1)
+    runs = [('blkavg2d (loop)', lambda: blkavg2d(a, blockshape)),
+            ('blockview + apply_over_axes', legacy_blkavg)]
+    runs += [('blkreduce {}'.format(func),
+              lambda func=func: blkreduce(a, blockshape, func=func))
+             for func in ('mean', 'sum', 'median', 'clipmean')]
 
-    t1 = time.time()
-    b = blkavg(a, blockshape)
-    t2 = time.time()
-    print('blkavg took {} s'.format(t2 - t1))
+    expected = None
+    timings = {}
+    for key, func in runs:
+        timings[key] = min(timeit.repeat(func, number=1, repeat=repeat))
+        print('{}: {:.4f} s'.format(key, timings[key]))
 
-    t1 = time.time()
-    c = blkavg2d(a, blockshape)
-    t2 = time.time()
-    print('blkavg2d took {} s'.format(t2 - t1))
+        if key == 'blkavg2d (loop)':
+            expected = func()
+        elif key.startswith('blockview') or key.endswith('mean'):
+            np.testing.assert_allclose(func(), expected)
 
-    np.testing.assert_array_almost_equal(c, b)
+    if doplot:
+        import matplotlib.pyplot as plt
 
-    fig = plt.figure()
-    ax1 = fig.add_subplot(121)
-    ax2 = fig.add_subplot(122)
+        fig = plt.figure()
+        ax1 = fig.add_subplot(121)
+        ax2 = fig.add_subplot(122)
 
-    ax1.imshow(a)
-    ax1.set_title('Original')
+        ax1.imshow(a)
+        ax1.set_title('Original')
 
-    ax2.imshow(b)
-    ax2.set_title('Block averaged by {}x{}'.format(*blockshape))
+        ax2.imshow(blkavg(a, blockshape))
+        ax2.set_title('Block averaged by {}x{}'.format(*blockshape))
 
-    plt.draw()
+        plt.draw()
+
+    return timings
+
+
+def test_blkrep():
+    """Round-trip :func:`blkrep` through :func:`blkavg`."""
+    rng = np.random.default_rng(1234)
+
+    for shape, blockshape in (((5, 7), (2, 3)), ((4, 3, 6), (3, 1, 2)),
+                              ((9, ), (4, )), ((3, 4), (1, 1))):
+        a = rng.normal(size=shape)
+
+        view = blkrep(a, blockshape)
+        assert np.shares_memory(view, a)
+        assert not view.flags.writeable
+
+        b = blkrep(a, blockshape, materialize=True)
+        assert b.shape == tuple(n * k for n, k in zip(shape, blockshape))
+        np.testing.assert_allclose(blkavg(b, blockshape), a)
+        np.testing.assert_array_equal(blockview(b, blockshape), view)
+
+        for func in ('mean', 'median', 'clipmean'):
+            np.testing.assert_allclose(
+                blkreduce(b, blockshape, func=func), a)
+
+        out = np.zeros_like(b)
+        assert blkrep(a, blockshape, out=out) is out
+        np.testing.assert_array_equal(out, b)
+
+        # Arithmetic on the view without materializing it.
+        c = rng.normal(size=b.shape)
+        expected = c / b
+        result = np.empty_like(c)
+        np.divide(blockview(c, blockshape), view,
+                  out=blockview(result, blockshape))
+        np.testing.assert_allclose(result, expected)
+
+
+def _full_blockshape(blockshape, ndim):
+    blockshape = tuple(int(b) for b in blockshape)
+    if len(blockshape) > ndim:
+        raise ValueError('more blocks specified than dimensions in the '
+                         'input array')
+    if any(b < 1 for b in blockshape):
+        raise ValueError('blocking factors must be positive')
+    # Dimensions not explicitly given are 1 by default
+    return blockshape + (1, ) * (ndim - len(blockshape))
+
+
+def _blocked_shape(shape, blockshape, edge='partial'):
+    if edge == 'trim':
+        return tuple(n // b for n, b in zip(shape, blockshape))
+    return tuple(-(-n // b) for n, b in zip(shape, blockshape))
+
+
+def _reduced_dtype(dtype, func):
+    return _REDUCERS[func](np.zeros(1, dtype=dtype), axis=(0, )).dtype
+
+
+def _is_dask_array(array):
+    return type(array).__module__.startswith('dask.')
+
+
+def _blkreduce_dask(array, blockshape, func='mean', edge='partial', **kwargs):
+    blockshape = _full_blockshape(blockshape, array.ndim)
+
+    # Every chunk but the last along each axis must be whole blocks.
+    aligned = []
+    for chunks, b in zip(array.chunks, blockshape):
+        if all(c % b == 0 for c in chunks[:-1]):
+            aligned.append(chunks)
+        else:
+            aligned.append(max(round(chunks[0] / b), 1) * b)
+    if any(isinstance(c, int) for c in aligned):
+        array = array.rechunk(tuple(aligned))
+
+    out_chunks = tuple(
+        tuple(_blocked_shape(chunks, (b, ) * len(chunks), edge=edge))
+        for chunks, b in zip(array.chunks, blockshape))
+
+    # partial because map_blocks has its own func argument.
+    reducer = functools.partial(blkreduce, blockshape=blockshape, func=func,
+                                edge=edge, **kwargs)
+    return array.map_blocks(reducer, chunks=out_chunks,
+                            dtype=_reduced_dtype(array.dtype, func))
+
+
+def _blocked_view(array, nblocks, blocks, writeable=False):
+    # Same as reshaping to interleaved (n0, b0, n1, b1, ...) and moving
+    # the block axes last, but always a view.
+    strides = (tuple(s * b for s, b in zip(array.strides, blocks)) +
+               array.strides)
+    return as_strided(array, tuple(nblocks) + tuple(blocks), strides,
+                      writeable=writeable)
+
+
+def _blocked_header(in_hdr, out_shape, dtype, blockshape):
+    # Primary header for the blocked image, with WCS scaled to match.
+    from astropy.io import fits
+
+    out_hdr = fits.PrimaryHDU(data=np.zeros((1, ) * len(out_shape),
+                                            dtype=dtype)).header
+    for i, n in enumerate(out_shape[::-1], start=1):
+        out_hdr['NAXIS{}'.format(i)] = n
+
+    hdr = in_hdr.copy(strip=True)
+    for key in ('BLANK', 'EXTNAME', 'EXTVER', 'CHECKSUM', 'DATASUM'):
+        hdr.remove(key, ignore_missing=True, remove_all=True)
+    out_hdr.extend(hdr)
+
+    # FITS axis j is the last-but-(j-1) Numpy axis. A blocked pixel
+    # covers pixels b*(p'-0.5)+0.5 to b*(p'+0.5)+0.5 in the original.
+    fits_blocks = blockshape[::-1]
+    has_cd = any(key.startswith('CD') and '_' in key for key in out_hdr)
+    has_pc = any(key.startswith('PC') and '_' in key for key in out_hdr)
+    naxis = len(out_shape)
+    for j, b in enumerate(fits_blocks, start=1):
+        if b == 1:
+            continue
+        key = 'CRPIX{}'.format(j)
+        if key in out_hdr:
+            out_hdr[key] = (out_hdr[key] - 0.5) / b + 0.5
+        for i in range(1, naxis + 1):
+            for prefix in ('CD', 'PC'):
+                key = '{}{}_{}'.format(prefix, i, j)
+                if key in out_hdr:
+                    out_hdr[key] *= b
+        key = 'CDELT{}'.format(j)
+        if not has_cd and not has_pc and key in out_hdr:
+            out_hdr[key] *= b
+
+    return out_hdr
+
+
+def _reduce_region(array, nblocks, blocks, func, sigma=3.0, maxiters=5,
+                   slab_bytes=2**24):
+    ndim = array.ndim
+    blocked = _blocked_view(array, nblocks, blocks)
+    block_axes = tuple(range(ndim, 2 * ndim))
+    reducer = _REDUCERS[func]
+    kwargs = {'sigma': sigma, 'maxiters': maxiters} if func == 'clipmean' else {}
+
+    # Rows of blocks per slab, at least one.
+    row_bytes = array.itemsize * max(array.size // max(nblocks[0], 1), 1)
+    nslab = max(slab_bytes // row_bytes, 1)
+
+    if nslab >= nblocks[0]:
+        return reducer(blocked, axis=block_axes, **kwargs)
+
+    out = None
+    for j in range(0, nblocks[0], nslab):
+        res = reducer(blocked[j:j + nslab], axis=block_axes, **kwargs)
+        if out is None:
+            out = np.empty(tuple(nblocks), dtype=res.dtype)
+        out[j:j + nslab] = res
+    return out
+
+
+def _clipped_mean(blocked, axis, sigma=3.0, maxiters=5):
+    data = np.array(blocked, dtype=np.float64)
+    for _ in range(maxiters):
+        mean = np.nanmean(data, axis=axis, keepdims=True)
+        std = np.nanstd(data, axis=axis, keepdims=True)
+        bad = np.abs(data - mean) > sigma * std
+        if not bad.any():
+            break
+        data[bad] = np.nan
+    return np.nanmean(data, axis=axis)
+
+
+_REDUCERS = {'mean': np.mean, 'sum': np.sum, 'median': np.median,
+             'clipmean': _clipped_mean}
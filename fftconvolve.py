@@ -5,17 +5,33 @@ Examples
 >>> import fftconvolve
 >>> fftconvolve.test()
 
+Let the fastest engine (direct, separable, or FFT) be picked:
+
+>>> outim, plan = fftconvolve.convolve2d(image, psf, return_plan=True)
+>>> plan.engine
+'separable'
+
+Convolve a mosaic too large for memory, tile by tile:
+
+>>> fftconvolve.fftconvolve_fits('mosaic_drz.fits', 'mosaic_conv.fits',
+...                              psf, ext=1, max_workers=4)
+
 References
 ----------
 http://www.rzuser.uni-heidelberg.de/~ge6/Programing/convolution.html
 
 """
+# STDLIB
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 # THIRD-PARTY
 import numpy as np
-from numpy.fft import fft2, ifft2
+from numpy.fft import irfft2, rfft2
 
 
-def fftconvolve2d(inData, inKernel):
+def fftconvolve2d(inData, inKernel, mode='same'):
     """
     Parameters
     ----------
@@ -24,47 +40,512 @@ def fftconvolve2d(inData, inKernel):
 
     inKernel: array_like
         Convolution kernel. Odd size preferred.
+        Its center pixel, ``inKernel.shape // 2``, lines up with
+        each image pixel in ``'same'`` mode. As before, the kernel is
+        slid over the image as is (not flipped), which makes no
+        difference for symmetric PSFs.
+
+    mode: {'same', 'full', 'valid'}
+        Output size:
+
+        * ``'same'``: Same as ``inData``.
+        * ``'full'``: Every overlap, ``inData.shape + inKernel.shape - 1``.
+        * ``'valid'``: Only where the kernel is fully inside the image,
+          ``inData.shape - inKernel.shape + 1``.
+
+    Returns
+    -------
+    outData: array_like
+        Convolved image.
+
+    See Also
+    --------
+    Convolver
+
+    """
+    return Convolver(inData.shape, inKernel, mode=mode)(inData)
+
+
+class Convolver(object):
+    """
+    FFT convolution of many same-size images with the same kernel.
+
+    The padding plan and the kernel spectrum are computed once here,
+    so each call only costs the image transforms. Results are the same
+    as :func:`fftconvolve2d`.
+
+    Parameters
+    ----------
+    data_shape: tuple of int
+        Shape of each image to be convolved.
+
+    inKernel: array_like
+        Convolution kernel. See :func:`fftconvolve2d`.
+
+    mode: {'same', 'full', 'valid'}
+        Output size. See :func:`fftconvolve2d`.
+
+    Examples
+    --------
+    >>> conv = Convolver((2048, 2048), psf)
+    >>> outim = conv(image)
+    >>> outstack = conv(stack_of_images, batch_size=8)
+
+    """
+    def __init__(self, data_shape, inKernel, mode='same'):
+        inKernel = np.asarray(inKernel)
+        self.data_shape = tuple(data_shape)
+        self.kernel_shape = inKernel.shape
+        self.mode = mode
+
+        # Size of linear convolution, padded to FFT-friendly size.
+        self.pad_shape = tuple(next_fast_len(n + k - 1) for n, k in
+                               zip(self.data_shape, self.kernel_shape))
+        self._slices = _output_slices(mode, self.data_shape,
+                                      self.kernel_shape)
+
+        buf = np.zeros(self.pad_shape)
+        y2, x2 = self.kernel_shape
+        buf[:y2, :x2] = inKernel[::-1, ::-1]
+        self.kernel_fft = rfft2(buf)
+
+    @property
+    def out_shape(self):
+        """Shape of each convolved image."""
+        return tuple(slc.stop - slc.start for slc in self._slices)
+
+    def __call__(self, inData, batch_size=None):
+        """
+        Parameters
+        ----------
+        inData: array_like
+            Image with ``data_shape``, or a stack of them along
+            the first axis.
+
+        batch_size: int or `None`
+            For a stack, number of images transformed together
+            in one batched FFT. If `None`, the whole stack.
+
+        Returns
+        -------
+        outData: array_like
+            Convolved image or stack.
+
+        """
+        if inData.shape[-2:] != self.data_shape:
+            raise ValueError('expected image shape {} but got {}'.format(
+                self.data_shape, inData.shape[-2:]))
+
+        if inData.ndim == 2:
+            return self._convolve(inData[np.newaxis])[0]
+        elif inData.ndim != 3:
+            raise ValueError('expected 2-D image or 3-D stack but got '
+                             '{}-D'.format(inData.ndim))
+
+        nimages = inData.shape[0]
+        if batch_size is None or batch_size >= nimages:
+            return self._convolve(inData)
+
+        outData = np.empty((nimages, ) + self.out_shape)
+        buf = np.zeros((batch_size, ) + self.pad_shape)
+        for i in range(0, nimages, batch_size):
+            batch = inData[i:i + batch_size]
+            outData[i:i + len(batch)] = self._convolve(batch, buf=buf)
+        return outData
+
+    def _convolve(self, stack, buf=None):
+        # Batched FFT over the last two axes; buf is the padded work array.
+        nimages = len(stack)
+        y1, x1 = self.data_shape
+        if buf is None:
+            buf = np.zeros((nimages, ) + self.pad_shape)
+        buf = buf[:nimages]
+        buf[:, :y1, :x1] = stack
+
+        im_fft = rfft2(buf, axes=(-2, -1))
+        im_fft *= self.kernel_fft
+        full = irfft2(im_fft, s=self.pad_shape, axes=(-2, -1))
+
+        return full[(slice(None), ) + self._slices].copy()
+
+
+# Rough cost in ns, to compare engines with each other. Calibrated
+# with same-mode convolution of 512x512 to 4096x4096 images.
+# Direct is per multiply-add of an output pixel, one pass per kernel
+# pixel (or per 1-D kernel pixel for separable). It is memory bound
+# once an image is more than about 8 MB, so each pass costs more.
+# Padding and output allocation add a cost per output pixel.
+# FFT is per P * log2(P) of padded size P.
+_DIRECT_COST = 2.0
+_DIRECT_COST_MEM = 4.4
+_DIRECT_CACHE_BYTES = 2**23
+_DIRECT_PIXEL_COST = 12.0
+_FFT_COST = 3.6
+
+
+class ConvolutionPlan(object):
+    """
+    Which engine :func:`convolve2d` picked, and why.
+
+    Attributes
+    ----------
+    engine: {'direct', 'separable', 'fft'}
+        Chosen engine.
+
+    costs: dict
+        Estimated cost (ns) of each engine that can be used.
+
+    rank: int
+        Numerical rank of the kernel from SVD. Rank 1 is separable.
+
+    factors: tuple of array_like or `None`
+        1-D Y and X kernels whose outer product is the kernel,
+        if separable.
+
+    data_shape, kernel_shape, mode
+        What this plan is for.
+
+    """
+    def __init__(self, data_shape, inKernel, mode='same', engine='auto',
+                 rtol=1e-8):
+        self.data_shape = tuple(data_shape)
+        self.mode = mode
+        self.factors = getattr(inKernel, 'factors', None)
+
+        if self.factors is not None:
+            # Already separable, e.g., psf_gaussian.SeparablePSF
+            self.rank = 1
+            self.kernel_shape = tuple(len(f) for f in self.factors)
+        else:
+            # Separable if only one singular value is significant.
+            self.kernel_shape = inKernel.shape
+            u, sv, vt = np.linalg.svd(inKernel)
+            self.rank = (int(np.count_nonzero(sv > rtol * sv[0]))
+                         if sv[0] else 0)
+            if self.rank <= 1:
+                scale = np.sqrt(sv[0])
+                self.factors = (u[:, 0] * scale, vt[0] * scale)
+
+        # Cost is driven by output size for direct, padded size for FFT.
+        out_size = np.prod([slc.stop - slc.start for slc in _output_slices(
+            mode, self.data_shape, self.kernel_shape)])
+        ky, kx = self.kernel_shape
+        pad_size = np.prod([next_fast_len(n + k - 1) for n, k in
+                            zip(self.data_shape, self.kernel_shape)])
+
+        if out_size * 8 <= _DIRECT_CACHE_BYTES:
+            pass_cost = _DIRECT_COST * out_size
+        else:
+            pass_cost = _DIRECT_COST_MEM * out_size
+        pixel_cost = _DIRECT_PIXEL_COST * out_size
+
+        self.costs = {'direct': pass_cost * ky * kx + pixel_cost,
+                      'fft': _FFT_COST * pad_size * np.log2(pad_size)}
+        if self.factors is not None:
+            self.costs['separable'] = pass_cost * (ky + kx) + pixel_cost
+
+        if engine == 'auto':
+            self.engine = min(self.costs, key=self.costs.get)
+        elif engine in self.costs:
+            self.engine = engine
+        elif engine == 'separable':
+            raise ValueError('kernel is not separable, rank={}'.format(
+                self.rank))
+        else:
+            raise ValueError("engine must be 'auto', 'direct', 'separable', "
+                             "or 'fft' but got {}".format(engine))
+
+    def __repr__(self):
+        costs = ', '.join('{}={:.3g}'.format(key, val)
+                          for key, val in sorted(self.costs.items()))
+        return ('<ConvolutionPlan engine={} data_shape={} kernel_shape={} '
+                'mode={} rank={} costs(ns): {}>'.format(
+                    self.engine, self.data_shape, self.kernel_shape,
+                    self.mode, self.rank, costs))
+
+
+def convolve2d(inData, inKernel, mode='same', engine='auto',
+               return_plan=False):
+    """
+    Convolve with whichever engine is estimated to be fastest.
+
+    Small kernels are faster to apply directly (one shifted
+    multiply-add per kernel pixel), separable kernels such as Gaussian
+    PSFs faster still as two 1-D passes, and large kernels by FFT.
+    Results are the same as :func:`fftconvolve2d` to floating-point
+    precision.
+
+    Parameters
+    ----------
+    inData: array_like
+        Image to be convolved.
+
+    inKernel: array_like or `psf_gaussian.SeparablePSF`
+        Convolution kernel. See :func:`fftconvolve2d`.
+        If it has 1-D ``factors``, they are used as is for the
+        separable engine, without SVD or building the 2-D kernel.
+
+    mode: {'same', 'full', 'valid'}
+        Output size. See :func:`fftconvolve2d`.
+
+    engine: {'auto', 'direct', 'separable', 'fft'}
+        Force an engine instead of picking one.
+
+    return_plan: bool
+        Also return the :class:`ConvolutionPlan` diagnostics.
 
     Returns
     -------
     outData: array_like
         Convolved image.
 
+    plan: `ConvolutionPlan`
+        Only if ``return_plan=True``.
+
+    """
+    plan = ConvolutionPlan(inData.shape, inKernel, mode=mode, engine=engine)
+
+    if plan.engine == 'separable':
+        outData = _separable_convolve(inData, plan.factors, mode=mode)
+    elif plan.engine == 'fft':
+        outData = fftconvolve2d(inData, np.asarray(inKernel), mode=mode)
+    else:
+        outData = _direct_convolve(inData, np.asarray(inKernel), mode=mode)
+
+    if return_plan:
+        return outData, plan
+    return outData
+
+
+def fftconvolve_tiled(inData, inKernel, tile_shape=(1024, 1024), out=None,
+                      max_workers=None):
+    """
+    Convolve a large image tile by tile (overlap-save).
+
+    Each output tile is computed from the input tile plus a halo of
+    half the kernel on each side, with the kernel spectrum computed only
+    once for all the tiles. Output tiles do not overlap, so the result
+    matches :func:`fftconvolve2d` in ``'same'`` mode to floating-point
+    precision everywhere, including at the seams. Only a few tiles are
+    in memory at any time.
+
+    Parameters
+    ----------
+    inData: array_like
+        Image to be convolved. Anything that can be sliced into Numpy
+        arrays works, e.g., memmap or FITS ``section``.
+
+    inKernel: array_like
+        Convolution kernel. See :func:`fftconvolve2d`.
+
+    tile_shape: tuple of int
+        Shape of each output tile, without halo. FFT is fastest when
+        ``tile_shape + inKernel.shape - 1`` are 5-smooth numbers.
+
+    out: array_like or `None`
+        Output array with same shape as image, e.g., memmap.
+        If `None`, a new array is returned.
+
+    max_workers: int or `None`
+        If given, number of threads to process tiles in parallel.
+        Otherwise, tiles are processed one at a time.
+
+    Returns
+    -------
+    outData: array_like
+        Convolved image; same as ``out`` if given.
+
     """
-    # Input sizes
     y1, x1 = inData.shape
     y2, x2 = inKernel.shape
-    x2_half = x2 * 0.5
-    y2_half = y2 * 0.5
-
-    # Padded size must be power of 2
-    l2_fac = np.log(2.0)
-    x_pad = 2**(int(np.log(x1 + x2) / l2_fac + 1.0))
-    y_pad = 2**(int(np.log(y1 + y2) / l2_fac + 1.0))
-    xp_half = x_pad * 0.5
-    yp_half = y_pad * 0.5
-
-    # Padded arrays for FFT
-    arr1 = np.zeros((y_pad, x_pad))
-    arr2 = arr1.copy()
-
-    # Pad image
-    xx1 = int(xp_half)
-    yy1 = int(yp_half)
-    arr1[yy1:yy1+y1, xx1:xx1+x1] = inData
-
-    # Pad kernel. PSF center must line up with image[0,0].
-    xx1 = int(xp_half - x2_half)
-    yy1 = int(yp_half - y2_half)
-    arr2[yy1:yy1+y2, xx1:xx1+x2] = inKernel
-
-    # 2D FFT and inverse. Discard imaginary component.
-    im_fft = fft2(arr1) * fft2(arr2[::-1, ::-1])
-    outData = (ifft2(im_fft))[:y1,:x1].real
+    ty, tx = min(tile_shape[0], y1), min(tile_shape[1], x1)
+
+    if out is None:
+        out = np.empty((y1, x1))
+    elif out.shape != (y1, x1):
+        raise ValueError('out must have shape {} but got {}'.format(
+            (y1, x1), out.shape))
+
+    # Input pixels needed before and after each output pixel.
+    y_before, x_before = y2 - 1 - y2 // 2, x2 - 1 - x2 // 2
+    conv = Convolver((ty + y2 - 1, tx + x2 - 1), inKernel, mode='valid')
+
+    def convolve_tile(origin):
+        yy1, xx1 = origin
+        h = min(ty, y1 - yy1)
+        w = min(tx, x1 - xx1)
+
+        # Input tile with halo, zero outside the image.
+        tile = np.zeros(conv.data_shape)
+        iy1 = yy1 - y_before
+        ix1 = xx1 - x_before
+        sy1, sx1 = max(iy1, 0), max(ix1, 0)
+        sy2 = min(iy1 + conv.data_shape[0], y1)
+        sx2 = min(ix1 + conv.data_shape[1], x1)
+        tile[sy1 - iy1:sy2 - iy1, sx1 - ix1:sx2 - ix1] = (
+            inData[sy1:sy2, sx1:sx2])
+
+        out[yy1:yy1 + h, xx1:xx1 + w] = conv(tile)[:h, :w]
+
+    origins = itertools.product(range(0, y1, ty), range(0, x1, tx))
+    if max_workers is None:
+        for origin in origins:
+            convolve_tile(origin)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # list() to re-raise any exception from the threads.
+            list(executor.map(convolve_tile, origins))
+
+    return out
+
 
+def fftconvolve_fits(infile, outfile, inKernel, ext=0, tile_shape=(1024, 1024),
+                     max_workers=None, overwrite=False):
+    """
+    Convolve a FITS image tile by tile from and to memory-mapped files.
+
+    Parameters
+    ----------
+    infile, outfile: str
+        Input and output FITS filenames. Output has the convolved image
+        (``'same'`` mode, 64-bit float) in its primary HDU, with the
+        input extension header.
+
+    inKernel: array_like
+        Convolution kernel. See :func:`fftconvolve2d`.
+
+    ext: int or str
+        Input image extension.
+
+    tile_shape, max_workers
+        See :func:`fftconvolve_tiled`.
+
+    overwrite: bool
+        Overwrite existing output file.
+
+    """
+    from astropy.io import fits
+
+    if os.path.exists(outfile) and not overwrite:
+        raise OSError('{} already exists'.format(outfile))
+
+    with fits.open(infile) as pf:
+        hdu = pf[ext]
+        shape = hdu.shape
+        if len(shape) != 2:
+            raise ValueError('expected 2-D image but got {}-D'.format(
+                len(shape)))
+
+        # Header with full-size data, without allocating the data.
+        out_hdr = fits.PrimaryHDU(data=np.zeros((1, 1))).header
+        out_hdr['NAXIS1'] = shape[1]
+        out_hdr['NAXIS2'] = shape[0]
+        hdr = hdu.header.copy(strip=True)
+        for key in ('BLANK', 'EXTNAME', 'EXTVER', 'CHECKSUM', 'DATASUM'):
+            hdr.remove(key, ignore_missing=True, remove_all=True)
+        out_hdr.extend(hdr)
+
+        # Write header, then grow file to full size. Data starts as zeros.
+        out_hdr.tofile(outfile, overwrite=overwrite)
+        nbytes = shape[0] * shape[1] * 8
+        nbytes += -nbytes % 2880  # FITS block padding
+        with open(outfile, 'rb+') as fout:
+            fout.seek(len(out_hdr.tostring()) + nbytes - 1)
+            fout.write(b'\0')
+
+        with fits.open(outfile, mode='update', memmap=True) as pf_out:
+            fftconvolve_tiled(hdu.section, inKernel, tile_shape=tile_shape,
+                              out=pf_out[0].data, max_workers=max_workers)
+
+
+def next_fast_len(n):
+    """Smallest 5-smooth number (2**i * 3**j * 5**k) not less than ``n``.
+
+    Real FFT of such sizes is fast, unlike sizes with large prime
+    factors, and they are much closer to ``n`` than the next power of 2.
+
+    """
+    n = int(n)
+    if n <= 6:
+        return max(n, 1)
+
+    best = 1 << (n - 1).bit_length()  # Next power of 2
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            # Smallest power of 2 that brings this up to n.
+            p2 = 1 << (-(-n // p35) - 1).bit_length()
+            best = min(best, p2 * p35)
+            p35 *= 3
+        p5 *= 5
+
+    return best
+
+
+def _padded_for_direct(inData, kernel_shape, mode):
+    # Zero-padded image and output slices, such that output pixel o is
+    # sum(kernel * padded[o:o + kernel_shape]) for each axis.
+    slices = _output_slices(mode, inData.shape, kernel_shape)
+    if mode == 'valid':  # No padding needed
+        slices = tuple(slice(0, slc.stop - slc.start) for slc in slices)
+        return np.asarray(inData, dtype=float), slices
+    pad = tuple((k - 1, k - 1) for k in kernel_shape)
+    return np.pad(np.asarray(inData, dtype=float), pad), slices
+
+
+def _direct_convolve(inData, inKernel, mode='same'):
+    padded, (sy, sx) = _padded_for_direct(inData, inKernel.shape, mode)
+    h, w = sy.stop - sy.start, sx.stop - sx.start
+    outData = np.zeros((h, w))
+    tmp = np.empty_like(outData)  # Scratch, to not allocate per pixel
+    for (i, j), val in np.ndenumerate(inKernel):
+        if val:
+            np.multiply(padded[sy.start + i:sy.start + i + h,
+                               sx.start + j:sx.start + j + w], val, out=tmp)
+            outData += tmp
+    return outData
+
+
+def _separable_convolve(inData, factors, mode='same'):
+    yker, xker = factors
+    padded, (sy, sx) = _padded_for_direct(inData, (len(yker), len(xker)),
+                                          mode)
+    h, w = sy.stop - sy.start, sx.stop - sx.start
+
+    # Along X for the rows needed, then along Y.
+    rows = padded[sy.start:sy.start + h + len(yker) - 1]
+    # Scratch buffers, to not allocate per kernel pixel.
+    tmp = np.zeros((rows.shape[0], w))
+    scratch = np.empty_like(tmp)
+    for j, val in enumerate(xker):
+        np.multiply(rows[:, sx.start + j:sx.start + j + w], val, out=scratch)
+        tmp += scratch
+
+    outData = np.zeros((h, w))
+    scratch = scratch[:h]
+    for i, val in enumerate(yker):
+        np.multiply(tmp[i:i + h], val, out=scratch)
+        outData += scratch
     return outData
 
 
+def _output_slices(mode, data_shape, kernel_shape):
+    # Slices of the full linear convolution for the given mode.
+    if mode == 'full':
+        return tuple(slice(0, n + k - 1)
+                     for n, k in zip(data_shape, kernel_shape))
+    elif mode == 'same':
+        return tuple(slice(k // 2, k // 2 + n)
+                     for n, k in zip(data_shape, kernel_shape))
+    elif mode == 'valid':
+        if any(k > n for n, k in zip(data_shape, kernel_shape)):
+            raise ValueError('kernel is larger than image in valid mode')
+        return tuple(slice(k - 1, n) for n, k in zip(data_shape, kernel_shape))
+    raise ValueError("mode must be 'same', 'full', or 'valid' "
+                     "but got {}".format(mode))
+
+
 def test():
     import matplotlib.pyplot as plt
 
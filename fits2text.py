@@ -12,22 +12,33 @@ Convert SYN FITS to text:
 
 >>> fits2txt.syn2txt('acs_f814w_005_syn.fits', 'acs_f814w_005_syn.txt')
 
+Convert any FITS table to CSV with a header line, a chunk of rows at a
+time, so tables larger than memory work:
+
+>>> fits2txt.table2txt('big_cat.fits', 'big_cat.csv', style='csv',
+...                    header=True, formats={'FLUX': '%.6e'})
+
 """
 # THIRD-PARTY
-import pyfits
+import numpy as np
+from astropy.io import fits
 
 
 __author__ = 'Pey Lian Lim'
 __organization__ = 'Space Telescope Science Institute'
 
+_SEPARATORS = {'tsv': '\t', 'csv': ',', 'fixed': ' '}
+_CHUNK_ROWS = 100000
 
-def imp2txt(inputFile, outFile, ext=1):
-    """Convert IMP FITS table to text.
+
+def table2txt(inputFile, outFile, ext=1, columns=None, formats=None,
+              style='tsv', header=False, chunk_rows=_CHUNK_ROWS):
+    """Convert FITS table to text, formatting a column at a time.
 
     Parameters
     ----------
     inputFile : string
-        IMP FITS table.
+        FITS table.
 
     outFile : string
         Output text table.
@@ -35,15 +46,69 @@ def imp2txt(inputFile, outFile, ext=1):
     ext : int, optional
         Table extension to convert.
 
+    columns : list of str, optional
+        Columns to write. Default is all.
+
+    formats : dict, optional
+        Maps column name to printf-style format, e.g., ``'%10.3f'``.
+        Other columns are written like ``str()`` of each cell,
+        with newlines in array cells replaced by spaces.
+
+    style : {'tsv', 'csv', 'fixed'}, optional
+        Tab-separated, comma-separated (quoted as needed), or
+        right-justified columns of constant width. For ``'fixed'``,
+        the table is read twice, once to find the widths.
+
+    header : bool, optional
+        Write column names as the first line.
+
+    chunk_rows : int, optional
+        Number of rows to format and write at a time.
+
     """
-    with pyfits.open(inputFile) as pf:
+    if style not in _SEPARATORS:
+        raise ValueError('style must be one of {} but got {}'.format(
+            sorted(_SEPARATORS), style))
+
+    with fits.open(inputFile) as pf:
         tabdata = pf[ext].data
+        if columns is None:
+            columns = tabdata.names
+
+        widths = None
+        if style == 'fixed':
+            widths = [len(c) if header else 0 for c in columns]
+            for cells in _iter_formatted(tabdata, columns, formats,
+                                         chunk_rows):
+                widths = [max(w, max(map(len, s), default=0))
+                          for w, s in zip(widths, cells)]
 
         # Write to text file (overwrite)
         with open(outFile, 'w') as fout:
-            for row in tabdata:
-                cols = [str(col).replace('\n', '   ') for col in row]
-                fout.write('\t'.join(cols) + '\n')
+            if header:
+                _write_chunk(fout, [[c] for c in columns], _SEPARATORS[style],
+                             style, widths)
+            for cells in _iter_formatted(tabdata, columns, formats,
+                                         chunk_rows):
+                _write_chunk(fout, cells, _SEPARATORS[style], style, widths)
+
+
+def imp2txt(inputFile, outFile, ext=1):
+    """Convert IMP FITS table to text.
+
+    Parameters
+    ----------
+    inputFile : string
+        IMP FITS table.
+
+    outFile : string
+        Output text table.
+
+    ext : int, optional
+        Table extension to convert.
+
+    """
+    table2txt(inputFile, outFile, ext=ext, style='tsv')
 
 
 def syn2txt(inputFile, outFile, ext=1):
@@ -61,8 +126,56 @@ def syn2txt(inputFile, outFile, ext=1):
         Table extension to convert.
 
     """
-    tabdata = pyfits.getdata(inputFile, ext)
+    columns = ['WAVELENGTH', 'THROUGHPUT']
+    formats = {'WAVELENGTH': '%10.3f', 'THROUGHPUT': '%15.7E'}
+
+    with fits.open(inputFile) as pf:
+        with open(outFile, 'w') as fout:
+            for cells in _iter_formatted(pf[ext].data, columns, formats,
+                                         _CHUNK_ROWS):
+                _write_chunk(fout, cells, ' ', None, None)
+
+
+def _iter_formatted(tabdata, columns, formats, chunk_rows):
+    """Yield list of formatted cells, one list per column,
+    for each chunk of rows."""
+    if formats is None:
+        formats = {}
+
+    for i in range(0, len(tabdata), chunk_rows):
+        chunk = tabdata[i:i + chunk_rows]
+        yield [_format_column(chunk[c], formats.get(c)) for c in columns]
+
+
+def _format_column(col, fmt):
+    """Format all the cells of a column as list of strings."""
+    # Array cells, fixed or variable length: same as str() of each,
+    # but on one line.
+    if col.ndim > 1 or col.dtype == object:
+        return [str(x).replace('\n', '   ') for x in col]
+
+    # tolist() gives Python scalars, which format faster than NumPy ones
+    # and the same for these formats.
+    if fmt is not None:
+        return list(map(fmt.__mod__, col.tolist()))
+
+    return np.asarray(col).astype(str).tolist()
+
+
+def _write_chunk(fout, cells, sep, style, widths):
+    """Join formatted columns into lines and write them."""
+    if style == 'csv':
+        cells = [list(map(_csv_quote, s)) for s in cells]
+    elif widths is not None:
+        cells = [[x.rjust(w) for x in s] for s, w in zip(cells, widths)]
+
+    text = '\n'.join(map(sep.join, zip(*cells)))
+    if text:
+        fout.write(text + '\n')
+
 
-    with open(outFile, 'w') as fout:
-        for w, t in zip(tabdata['WAVELENGTH'], tabdata['THROUGHPUT']):
-            fout.write('{:10.3f} {:15.7E}\n'.format(w, t))
+def _csv_quote(x):
+    """Quote CSV field if needed, as in RFC 4180."""
+    if ',' in x or '"' in x or '\n' in x:
+        return '"{}"'.format(x.replace('"', '""'))
+    return x
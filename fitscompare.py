@@ -12,13 +12,29 @@ Divide im1.fits by im2.fits:
 
 >>> imcalc('im1.fits', 'im2.fits', 'diff.fits', op='/')
 
+Any binary ufunc works too, with row blocks computed in 4 threads:
+
+>>> import numpy as np
+>>> imcalc('im1.fits', 'im2.fits', 'max.fits', op=np.maximum, max_workers=4)
+
+Summarize differences of many outputs from their references without
+writing difference images, 8 file pairs at a time:
+
+>>> from fitscompare import compare
+>>> tab = compare(out_files, ref_files, atol=1e-5, rtol=1e-6, max_workers=8)
+>>> tab[tab['NOVER'] > 0]
+
 """
 # STDLIB
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 # THIRD-PARTY
-import pyfits
+import numpy as np
+from astropy.io import fits
+from astropy.table import Table
 
 
 __author__ = 'Pey Lian Lim'
@@ -26,8 +42,18 @@ __organization__ = 'Space Telescope Science Institute'
 
 module_logger = logging.getLogger('fitscompare')
 
+_OPS = {'-': np.subtract, '/': np.true_divide, '+': np.add, '*': np.multiply}
+
+# Types FITS images store without BZERO/BSCALE.
+_FITS_DTYPES = ('uint8', 'int16', 'int32', 'int64', 'float32', 'float64')
+
+# Columns of compare() output.
+_SUMMARY_COLS = ('IMAGE1', 'IMAGE2', 'EXT', 'EXTNAME', 'EXTVER', 'STATUS',
+                 'NPIX', 'NBAD', 'NOVER', 'MAXDIFF', 'RMSDIFF', 'WORST')
 
-def imcalc(image1, image2, out_im, op='-'):
+
+def imcalc(image1, image2, out_im, op='-', block_bytes=2**26,
+           max_workers=None):
     """Compute difference or ratio between 2 FITS images.
 
     Each output extension stores the result of the
@@ -41,77 +67,314 @@ def imcalc(image1, image2, out_im, op='-'):
         ...
         N. Data
 
+    Inputs are read with memory mapping a block of rows at a time,
+    and each output extension is written as the blocks are done with
+    `~astropy.io.fits.StreamingHDU`, so memory use does not grow
+    with image size.
+
     Parameters
     ----------
     image1, image2 : string
         Input FITS images.
 
     out_im : string
-        Output FITS image.
+        Output FITS image. Overwritten if exists.
 
-    op : {'-', '/'}
+    op : {'-', '/', '+', '*'} or callable
         Supports the following operations:
             * '-' = image1 - image2 (default)
             * '/' = image1 / image2
+            * '+' = image1 + image2
+            * '*' = image1 * image2
+            * ``op(image1, image2)``, e.g., `numpy.maximum`
 
-    """
-    min_ext = 2
+    block_bytes : int
+        Approximate size of input rows to process at a time.
 
-    pf_1 = pyfits.open(image1)
-    pf_2 = pyfits.open(image2)
+    max_workers : int or `None`
+        Compute this many row blocks at a time in threads.
+        If `None`, blocks are done serially. Blocks are still written
+        in order, and extensions one after another, as a FITS file
+        can only be streamed sequentially.
 
-    next_1 = len(pf_1)
-    next_2 = len(pf_2)
+    """
+    min_ext = 2
 
-    # Inputs must have at least 1 primary header and 1 data ext
-    if next_1 < min_ext:
-        pf_1.close()
-        pf_2.close()
-        raise ValueError('image1 has {} ext but expect >={}.'.format(
-            next_1, min_ext))
+    if callable(op):
+        func = op
+        op_name = getattr(op, '__name__', repr(op))
+    elif op in _OPS:
+        func = _OPS[op]
+        op_name = op
+    else:
+        raise ValueError('op must be one of {} or callable but got '
+                         '{}'.format(sorted(_OPS), op))
+
+    # Memory mapped by default. Not forcing memmap=True lets sections
+    # of scaled (BZERO/BSCALE) images still be read.
+    with fits.open(image1) as pf_1, fits.open(image2) as pf_2:
+        next_1 = len(pf_1)
+        next_2 = len(pf_2)
+
+        # Inputs must have at least 1 primary header and 1 data ext
+        if next_1 < min_ext:
+            raise ValueError('image1 has {} ext but expect >={}.'.format(
+                next_1, min_ext))
+
+        # Inputs must have same number of extensions
+        if next_1 != next_2:
+            raise ValueError('image1 has {} ext but image2 has {}.'.format(
+                next_1, next_2))
+
+        out_phdr = fits.PrimaryHDU()
+        out_phdr.header.add_history('IMAGE1 {}'.format(
+            os.path.basename(image1)))
+        out_phdr.header.add_history('IMAGE2 {}'.format(
+            os.path.basename(image2)))
+        out_phdr.header.add_history('IMAGE1 {} IMAGE2'.format(op_name))
+        out_phdr.writeto(out_im, overwrite=True)
+
+        if max_workers is None:
+            executor = None
+        else:
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        try:
+            for i in range(1, next_1):
+                _stream_ext(pf_1[i], pf_2[i], i, func, out_im, block_bytes,
+                            executor, max_workers)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+
+def _stream_ext(hdu_1, hdu_2, i, func, out_im, block_bytes, executor,
+                max_workers):
+    """Compute one extension in row blocks and append it to ``out_im``.
+    ``hdu_1`` supplies EXTNAME and EXTVER."""
+    shape = hdu_1.shape
+
+    if not shape or not hdu_2.shape:
+        module_logger.warning('input(s) has NoneType data.')
+        shdu = fits.StreamingHDU(
+            out_im, fits.ImageHDU(name=hdu_1.name, ver=hdu_1.ver).header)
+        shdu.close()
+        return
+
+    if shape != hdu_2.shape:
+        raise ValueError('In ext {}, image1 has shape {} but image2 has '
+                         '{}'.format(i, shape, hdu_2.shape))
+
+    section_1 = hdu_1.section
+    section_2 = hdu_2.section
+
+    # Scaled data come out as float, so look at what the sections give.
+    dtype_1 = section_1[:1].dtype
+    dtype_2 = section_2[:1].dtype
+    if dtype_1 != dtype_2:
+        module_logger.warning('In ext {}, image1 is {} but image2 is '
+                              '{}'.format(i, dtype_1, dtype_2))
+
+    block_rows = _block_rows(shape, block_bytes)
+
+    def calc_rows(y1):
+        out = func(section_1[y1:y1 + block_rows],
+                   section_2[y1:y1 + block_rows])
+        return out.astype(_fits_dtype(out.dtype), copy=False)
+
+    starts = range(0, shape[0], block_rows)
+    if executor is None:
+        blocks = map(calc_rows, starts)
+    else:
+        # Only a round of blocks at a time in memory.
+        blocks = (block for j in range(0, len(starts), max_workers)
+                  for block in list(executor.map(
+                      calc_rows, starts[j:j + max_workers])))
+
+    shdu = None
+    try:
+        for block in blocks:
+            if shdu is None:  # Now we know the output dtype
+                hdr = fits.ImageHDU(
+                    data=np.zeros((1, ) * len(shape), dtype=block.dtype),
+                    name=hdu_1.name, ver=hdu_1.ver).header
+                for j, n in enumerate(shape[::-1], start=1):
+                    hdr['NAXIS{}'.format(j)] = n
+                shdu = fits.StreamingHDU(out_im, hdr)
+            shdu.write(block)
+    finally:
+        if shdu is not None:
+            shdu.close()
+
+
+def _fits_dtype(dtype):
+    """Smallest dtype that FITS stores natively without scaling
+    and holds all values of ``dtype``."""
+    if dtype.name in _FITS_DTYPES:
+        return dtype
+    for name in ('int16', 'int32', 'int64', 'float64'):
+        if np.can_cast(dtype, name):
+            return np.dtype(name)
+    return np.dtype('float64')
+
+
+def compare(images1, images2, atol=0, rtol=0, block_bytes=2**26,
+            max_workers=None):
+    """Summarize differences between pairs of FITS images.
+
+    No difference image is written. See :func:`diffstats`.
 
-    # Inputs must have same number of extensions
-    if next_1 != next_2:
-        pf_1.close()
-        pf_2.close()
-        raise ValueError('image1 has {} ext but image2 has {}.'.format(
-            next_1, next_2))
+    Parameters
+    ----------
+    images1, images2 : list of string
+        Input FITS images, e.g., pipeline outputs and their references.
+        They are compared pairwise.
 
-    out_phdr = pyfits.PrimaryHDU()
-    out_phdr.header.add_history('IMAGE1 {}'.format(os.path.basename(image1)))
-    out_phdr.header.add_history('IMAGE2 {}'.format(os.path.basename(image2)))
-    out_phdr.header.add_history('IMAGE1 {} IMAGE2'.format(op))
+    atol, rtol, block_bytes
+        See :func:`diffstats`.
 
-    out_hdu  = pyfits.HDUList([out_phdr])
+    max_workers : int or `None`
+        Compare this many pairs at a time in threads.
+        If `None`, pairs are done serially.
 
-    for i in xrange(1, next_1):
-        data_1 = pf_1[i].data
-        data_2 = pf_2[i].data
+    Returns
+    -------
+    tab : `~astropy.table.Table`
+        One row per extension, with columns as in :func:`diffstats`.
 
-        if data_1 is None or data_2 is None:
-            module_logger.warn('input(s) has NoneType data.')
-            hdu = pyfits.ImageHDU()
+    """
+    if len(images1) != len(images2):
+        raise ValueError('Got {} image1 but {} image2'.format(
+            len(images1), len(images2)))
 
-        else:
-            if data_1.dtype != data_2.dtype:
-                module_logger.warn(
-                    'In ext {}, image1 is {} but image2 is {}'.format(
-                    i, data_1.dtype, data_2.dtype))
+    func = partial(diffstats, atol=atol, rtol=rtol, block_bytes=block_bytes)
+    if max_workers is None:
+        results = map(func, images1, images2)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(func, images1, images2))
 
-            if op == '/':
-                out_data = data_1 / data_2
-            else:
-                out_data = data_1 - data_2
+    rows = [row for result in results for row in result]
+    return Table({name: [row[name] for row in rows] for name in _SUMMARY_COLS},
+                 names=_SUMMARY_COLS)
 
-            hdu = pyfits.ImageHDU(out_data)
 
-        # Inherit EXTNAME and EXTVER from image1
-        hdu.update_ext_name(pf_1[i].name)
-        hdu.update_ext_version(pf_1[i]._extver)
+def diffstats(image1, image2, atol=0, rtol=0, block_bytes=2**26):
+    """Difference statistics of 2 FITS images, extension by extension.
 
-        out_hdu.append(hdu)
+    Both images are read in one pass, a block of rows at a time,
+    with the difference ``image1 - image2`` in double precision.
 
-    out_hdu.writeto(out_im, clobber=True)
+    Parameters
+    ----------
+    image1, image2 : string
+        Input FITS images, in the format expected by :func:`imcalc`.
+
+    atol, rtol : float
+        A pixel is over tolerance if
+        ``abs(image1 - image2) > atol + rtol * abs(image2)``,
+        as in `numpy.isclose`.
+
+    block_bytes : int
+        Approximate size of input rows to process at a time.
+
+    Returns
+    -------
+    rows : list of dict
+        One per data extension, with keys:
+
+        * ``IMAGE1``, ``IMAGE2``, ``EXT``, ``EXTNAME``, ``EXTVER``
+        * ``STATUS``: 'ok', 'no data', 'shape mismatch', or
+          'ext mismatch' (then ``EXT`` is -1). Statistics are only
+          filled in for 'ok'.
+        * ``NPIX``: Number of pixels.
+        * ``NBAD``: Pixels where the difference is not finite,
+          except where both are NaN or the same infinity. These are
+          over tolerance. Neither they nor those equal non-finite
+          pixels go into ``MAXDIFF`` or ``RMSDIFF``.
+        * ``NOVER``: Pixels over tolerance.
+        * ``MAXDIFF``: Maximum absolute difference.
+        * ``RMSDIFF``: Root-mean-square difference.
+        * ``WORST``: 0-indexed NumPy location of ``MAXDIFF``,
+          as string.
 
-    pf_1.close()
-    pf_2.close()
+    """
+    # Memory mapped by default, see imcalc().
+    with fits.open(image1) as pf_1, fits.open(image2) as pf_2:
+        if len(pf_1) != len(pf_2):
+            row = _summary_row(image1, image2, -1, '', 0, 'ext mismatch')
+            return [row]
+
+        rows = []
+        for i in range(1, len(pf_1)):
+            hdu_1 = pf_1[i]
+            hdu_2 = pf_2[i]
+            shape = hdu_1.shape
+            row = _summary_row(image1, image2, i, hdu_1.name, hdu_1.ver)
+            rows.append(row)
+
+            if not shape or not hdu_2.shape:
+                row['STATUS'] = 'no data'
+                continue
+            if shape != hdu_2.shape:
+                row['STATUS'] = 'shape mismatch'
+                continue
+
+            section_1 = hdu_1.section
+            section_2 = hdu_2.section
+            block_rows = _block_rows(shape, block_bytes)
+            row_size = int(np.prod(shape[1:]))
+            nbad = nover = ngood = 0
+            sumsq = 0.0
+            maxdiff = -1.0
+            worst = 0
+
+            for y1 in range(0, shape[0], block_rows):
+                data_1 = section_1[y1:y1 + block_rows]
+                data_2 = section_2[y1:y1 + block_rows]
+                with np.errstate(invalid='ignore'):
+                    absdiff = np.abs(np.subtract(data_1, data_2,
+                                                 dtype=np.float64))
+                    over = absdiff > atol + rtol * np.abs(data_2,
+                                                          dtype=np.float64)
+
+                # Equal infinities and NaN in both are equal, as in isclose.
+                good = np.isfinite(absdiff)
+                equal = (data_1 == data_2) | (np.isnan(data_1) &
+                                              np.isnan(data_2))
+                bad = ~good & ~equal
+                ngood += int(good.sum())
+                nbad += int(bad.sum())
+                nover += int((bad | (good & over)).sum())
+
+                absdiff[~good] = -1
+                j = int(absdiff.argmax())
+                if absdiff.flat[j] > maxdiff:
+                    maxdiff = float(absdiff.flat[j])
+                    worst = y1 * row_size + j
+                sumsq += float(np.square(absdiff[good]).sum())
+
+            npix = int(np.prod(shape))
+            row.update(NPIX=npix, NBAD=nbad, NOVER=nover)
+            if ngood:
+                row['MAXDIFF'] = maxdiff
+                row['RMSDIFF'] = np.sqrt(sumsq / ngood)
+                row['WORST'] = str(tuple(
+                    int(k) for k in np.unravel_index(worst, shape)))
+            row['STATUS'] = 'ok'
+
+    return rows
+
+
+def _summary_row(image1, image2, ext, extname, extver, status=''):
+    """Row of :func:`diffstats` with empty statistics."""
+    return {'IMAGE1': image1, 'IMAGE2': image2, 'EXT': ext,
+            'EXTNAME': extname, 'EXTVER': extver, 'STATUS': status,
+            'NPIX': 0, 'NBAD': 0, 'NOVER': 0, 'MAXDIFF': np.nan,
+            'RMSDIFF': np.nan, 'WORST': ''}
+
+
+def _block_rows(shape, block_bytes):
+    """Number of rows of 8-byte pixels in ``block_bytes``."""
+    row_bytes = 8 * int(np.prod(shape[1:]))
+    return max(block_bytes // row_bytes, 1)
@@ -29,9 +29,20 @@ nicetable.fits written
 1.17793e+09     8.0 1.30699e+16
  1.1584e+09     8.0 1.31217e+16
 
+For big inputs, or many files to be stacked into one table, stream
+the rows a block at a time instead:
+
+>>> im2tab.convert_stream(['night1.fits', 'night2.fits'], 'nicetable.fits')
+Copied the header
+Converted 3 columns
+nicetable.fits written
+
 """
 from __future__ import division, print_function
 
+import os
+
+import numpy as np
 from astropy.io import fits
 
 
@@ -79,7 +90,93 @@ def convert(inputfile, outputfile, clobber=False, verbose=True):
         if verbose:
             print('Converted {0} columns'.format(len(cols)))
 
-    thdulist.writeto(outputfile, clobber=clobber)
+        thdulist.writeto(outputfile, overwrite=clobber)
+
+    if verbose:
+        print(outputfile, 'written')
+
+
+def convert_stream(inputfiles, outputfile, clobber=False, verbose=True,
+                   block_rows=65536):
+    """Like :func:`convert` but stream rows into the output table.
+
+    Only ``block_rows`` rows of all the columns are in memory at a
+    time. Image extensions are read with memory mapping (the
+    `~astropy.io.fits.open` default, which still allows scaled images)
+    and the table is written with `~astropy.io.fits.StreamingHDU`.
+
+    Parameters
+    ----------
+    inputfiles : str or list of str
+        Input filename(s). Rows from several files are stacked into
+        one table, in the given order. They must all have the same
+        image extension names. The primary header is copied from
+        the first file.
+
+    outputfile : str
+        Output filename.
+
+    clobber : bool, optional
+        Overwrite existing file.
+
+    verbose : bool, optional
+        Print extra info.
+
+    block_rows : int, optional
+        Number of rows to write at a time.
+
+    """
+    if isinstance(inputfiles, str):
+        inputfiles = [inputfiles]
+
+    if os.path.exists(outputfile):
+        if not clobber:
+            raise OSError('{} already exists'.format(outputfile))
+        os.remove(outputfile)
+
+    # Check the inputs and count the rows before writing anything.
+    names = None
+    nrows = 0
+    for inputfile in inputfiles:
+        with fits.open(inputfile) as pf:
+            cur_names = [pfext.name for pfext in pf[1:]]
+            shapes = set(pfext.shape for pfext in pf[1:])
+        if names is None:
+            names = cur_names
+        elif cur_names != names:
+            raise ValueError('{} has extensions {} but expected {}'.format(
+                inputfile, cur_names, names))
+        if len(shapes) != 1 or len(list(shapes)[0]) != 1:
+            raise ValueError('{} must have 1-D image extensions of the same '
+                             'length'.format(inputfile))
+        nrows += shapes.pop()[0]
+
+    # Primary header
+    with fits.open(inputfiles[0]) as pf:
+        fits.HDUList([pf[0]]).writeto(outputfile)
+    if verbose:
+        print('Copied the header')
+
+    # Table header without allocating the table
+    tbhdr = fits.BinTableHDU.from_columns(
+        [fits.Column(name=name, format='E') for name in names]).header
+    tbhdr['NAXIS2'] = nrows
+    dtype = np.dtype([(name, '>f4') for name in names])
+
+    shdu = fits.StreamingHDU(outputfile, tbhdr)
+    try:
+        for inputfile in inputfiles:
+            with fits.open(inputfile) as pf:
+                sections = [pfext.section for pfext in pf[1:]]
+                n = pf[1].shape[0]
+                for i in range(0, n, block_rows):
+                    block = np.empty(min(block_rows, n - i), dtype=dtype)
+                    for name, section in zip(names, sections):
+                        block[name] = section[i:i + block_rows]
+                    shdu.write(block.view(np.uint8))
+    finally:
+        shdu.close()
 
     if verbose:
+        print('Converted {0} columns'.format(len(names)))
         print(outputfile, 'written')
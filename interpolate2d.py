@@ -1,23 +1,41 @@
-"""Simple 2D interpolation.
+"""Simple 2D interpolation of scattered data onto a grid.
 
 Examples
 --------
 >>> import interpolate2d
 >>> interpolate2d.example1()
 
+Interpolate many value sets measured at the same sites, building the
+triangulation and the grid weights only once:
+
+>>> interp = interpolate2d.ScatteredInterpolator(x, y, method='linear')
+>>> images = [interp(z, (1024, 1024)) for z in many_z]
+
+For large grids, evaluate in row blocks straight into a memory-mapped
+output, without plotting (matplotlib is then never imported):
+
+>>> out = np.lib.format.open_memmap('im.npy', mode='w+', dtype=np.float64,
+...                                 shape=(4096, 4096))
+>>> interpolate2d.interp2d(x, y, z, out.shape, verbose=False, doplot=False,
+...                        out=out, block_rows=256, max_workers=4)
+
 References
 ----------
-http://www.scipy.org/doc/api_docs/SciPy.interpolate.interpolate.interp2d.html
+https://docs.scipy.org/doc/scipy/tutorial/interpolate/ND_unstructured.html
 
 """
 
+# STDLIB
+from concurrent.futures import ThreadPoolExecutor
+
 # THIRD-PARTY
-import matplotlib.pyplot as plt
 import numpy as np
 from scipy import interpolate
+from scipy.spatial import cKDTree, Delaunay
 
 
-def interp2d(x, y, z, outshape, verbose=True, doplot=True):
+def interp2d(x, y, z, outshape, verbose=True, doplot=True, method='linear',
+             fill_value=np.nan, out=None, block_rows=None, max_workers=None):
     """
     Parameters
     ----------
@@ -36,6 +54,16 @@ def interp2d(x, y, z, outshape, verbose=True, doplot=True):
     doplot : bool, optional
         Plot results.
 
+    method : {'linear', 'cubic', 'rbf', 'nearest'}, optional
+        See :class:`ScatteredInterpolator`.
+
+    fill_value : float, optional
+        Value outside the convex hull of the data for
+        ``'linear'`` and ``'cubic'``.
+
+    out, block_rows, max_workers : optional
+        See :meth:`ScatteredInterpolator.__call__`.
+
     Returns
     -------
     im : float array
@@ -44,40 +72,260 @@ def interp2d(x, y, z, outshape, verbose=True, doplot=True):
     """
     # Print the data to screen for checking
     if verbose:
-        print 'DATA USED FOR INTERPOLATION:'
-        for i, (xx, yy, zz) in enumerate(zip(x, y, z), start=1):
-            print '{}: {} {} {}'.format(i, xx, yy, zz)
+        print_data(x, y, z)
 
     # Perform 2D interpolation
-    func = interpolate.interpolate.interp2d(x, y, z)
-    im = func(np.mgrid[:outshape[1]], np.mgrid[:outshape[0]])
+    interp = ScatteredInterpolator(x, y, method=method, fill_value=fill_value)
+    im = interp(z, outshape, out=out, block_rows=block_rows,
+                max_workers=max_workers)
 
     if doplot:
-        # Get min/max to use same colorbar on for base and overlay
-        pmin = im.min()
-        pmax = im.max()
+        plot_interp(im, x, y, z)
 
-        fig, ax = plt.subplots()
+    return im
 
-        # Show interpolated 2D image
-        p = ax.imshow(im, vmin=pmin, vmax=pmax)
 
-        # Overlay data points used for interpolation
-        ax.scatter(x, y, s=100, c=z, vmin=pmin, vmax=pmax, marker='s')
+def print_data(x, y, z):
+    """Print the data used for interpolation."""
+    print('DATA USED FOR INTERPOLATION:')
+    for i, (xx, yy, zz) in enumerate(zip(x, y, z), start=1):
+        print('{}: {} {} {}'.format(i, xx, yy, zz))
 
-        # Display colorbar.
-        # Shrink to make it same width as display.
-        c = fig.colorbar(p, orientation='horizontal', shrink=0.7)
-        c.set_label('Pixel value')
 
-        # Plot labels
-        ax.set_xlabel('X')
-        ax.set_ylabel('Y')
-        ax.set_title('Interpolated image')
+def plot_interp(im, x, y, z):
+    """Plot interpolated image with the data points overlaid."""
+    import matplotlib.pyplot as plt
 
-        plt.draw()
+    # Get min/max to use same colorbar on for base and overlay
+    pmin = np.nanmin(im)
+    pmax = np.nanmax(im)
 
-    return im
+    fig, ax = plt.subplots()
+
+    # Show interpolated 2D image
+    p = ax.imshow(im, vmin=pmin, vmax=pmax)
+
+    # Overlay data points used for interpolation
+    ax.scatter(x, y, s=100, c=z, vmin=pmin, vmax=pmax, marker='s')
+
+    # Display colorbar.
+    # Shrink to make it same width as display.
+    c = fig.colorbar(p, orientation='horizontal', shrink=0.7)
+    c.set_label('Pixel value')
+
+    # Plot labels
+    ax.set_xlabel('X')
+    ax.set_ylabel('Y')
+    ax.set_title('Interpolated image')
+
+    plt.draw()
+
+
+class ScatteredInterpolator(object):
+    """
+    Interpolate values at scattered sites onto a grid.
+
+    Unlike the global spline fit of the removed
+    ``scipy.interpolate.interp2d``, the cost grows gently with
+    the number of sites. The geometry (triangulation or tree) is
+    built once for the given sites and reused for every set of values.
+    For ``'linear'`` and ``'nearest'``, the weights for the last output
+    grid are also kept, so each new set of values is only a weighted
+    sum.
+
+    Parameters
+    ----------
+    x, y : array_like
+        X and Y positions of the sites.
+
+    method : {'linear', 'cubic', 'rbf', 'nearest'}
+        * ``'linear'``: Barycentric within Delaunay triangles.
+        * ``'cubic'``: Clough-Tocher on the same triangles.
+        * ``'rbf'``: Radial basis function using only the
+          ``neighbors`` closest sites for each output pixel.
+        * ``'nearest'``: Value of the closest site.
+
+    fill_value : float
+        Value outside the convex hull of the sites for
+        ``'linear'`` and ``'cubic'``.
+
+    neighbors : int or `None`
+        Number of sites for ``'rbf'``. If `None`, all of them,
+        which does not scale to many sites.
+
+    kernel : str
+        RBF kernel for ``'rbf'``.
+        See `scipy.interpolate.RBFInterpolator`.
+
+    """
+    def __init__(self, x, y, method='linear', fill_value=np.nan,
+                 neighbors=50, kernel='thin_plate_spline'):
+        self.points = np.column_stack([np.ravel(x), np.ravel(y)]).astype(
+            np.float64)
+        self.method = method
+        self.fill_value = fill_value
+        self.neighbors = neighbors
+        self.kernel = kernel
+
+        if method in ('linear', 'cubic'):
+            self.tri = Delaunay(self.points)
+        elif method == 'nearest':
+            self.tree = cKDTree(self.points)
+        elif method != 'rbf':
+            raise ValueError("method must be 'linear', 'cubic', 'rbf', or "
+                             "'nearest' but got {}".format(method))
+
+        # (outshape, weights) of the last grid for linear and nearest.
+        self._grid_weights = (None, None)
+
+    def __call__(self, z, outshape, out=None, block_rows=None,
+                 max_workers=None):
+        """
+        Parameters
+        ----------
+        z : array_like
+            Values at the sites, or a stack of value sets
+            with shape ``(nsets, nsites)``.
+
+        outshape : tuple of int
+            Shape of 2-D output array. Output pixel ``[j, i]`` is at
+            ``x=i`` and ``y=j``.
+
+        out : array_like or `None`
+            Preallocated output, e.g., `numpy.memmap`, with shape
+            ``z.shape[:-1] + outshape``. If `None`, a new array is made.
+
+        block_rows : int or `None`
+            Evaluate this many output rows at a time, so the temporary
+            coordinates and weights stay small. Weights are then not
+            kept between calls. If `None`, evaluate the whole grid at
+            once.
+
+        max_workers : int or `None`
+            Evaluate row blocks in this many threads. If `None`,
+            row blocks are done serially.
+
+        Returns
+        -------
+        im : array_like
+            Interpolated image with ``outshape``, or a stack of them.
+
+        """
+        z = np.asarray(z, dtype=np.float64)
+        outshape = tuple(outshape)
+        ny, nx = outshape
+
+        if out is None:
+            out = np.empty(z.shape[:-1] + outshape, dtype=np.float64)
+        elif out.shape != z.shape[:-1] + outshape:
+            raise ValueError('out has shape {} but expected {}'.format(
+                out.shape, z.shape[:-1] + outshape))
+
+        if block_rows is None:
+            yi, xi = np.indices(outshape)
+            xi = xi.ravel()
+            yi = yi.ravel()
+
+            if self.method in ('linear', 'nearest'):
+                if self._grid_weights[0] != outshape:
+                    self._grid_weights = (outshape, self._weights(xi, yi))
+                im = self._apply_weights(z, self._grid_weights[1])
+            else:
+                im = self._interpolant(z)(xi, yi)
+
+            out[...] = im.reshape(out.shape)
+            return out
+
+        func = self._interpolant(z)
+
+        def evaluate_rows(y1):
+            y2 = min(y1 + block_rows, ny)
+            yi, xi = np.mgrid[y1:y2, :nx]
+            out[..., y1:y2, :] = func(xi.ravel(), yi.ravel()).reshape(
+                z.shape[:-1] + (y2 - y1, nx))
+
+        starts = range(0, ny, block_rows)
+        if max_workers is None:
+            for y1 in starts:
+                evaluate_rows(y1)
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # list() to re-raise any exception from the threads.
+                list(executor.map(evaluate_rows, starts))
+
+        return out
+
+    def evaluate(self, z, xi, yi):
+        """
+        Interpolate at arbitrary positions.
+
+        Parameters
+        ----------
+        z : array_like
+            Values at the sites, or a stack of value sets
+            with shape ``(nsets, nsites)``.
+
+        xi, yi : array_like
+            1-D X and Y positions to interpolate at.
+
+        Returns
+        -------
+        zi : array_like
+            Interpolated values with shape ``z.shape[:-1] + xi.shape``.
+
+        """
+        z = np.asarray(z, dtype=np.float64)
+        xi = np.asarray(xi, dtype=np.float64)
+        yi = np.asarray(yi, dtype=np.float64)
+
+        return self._interpolant(z)(xi, yi)
+
+    def _interpolant(self, z):
+        # Function of (xi, yi) for the given values. Cubic gradients and
+        # RBF coefficients are only computed once here.
+        if self.method in ('linear', 'nearest'):
+            return lambda xi, yi: self._apply_weights(
+                z, self._weights(xi, yi))
+
+        # scipy wants values as (nsites, nsets).
+        zt = np.moveaxis(z, -1, 0)
+        if self.method == 'cubic':
+            func = interpolate.CloughTocher2DInterpolator(
+                self.tri, zt, fill_value=self.fill_value)
+        else:
+            func = interpolate.RBFInterpolator(
+                self.points, zt, neighbors=self.neighbors,
+                kernel=self.kernel)
+        return lambda xi, yi: np.moveaxis(
+            func(np.column_stack([xi, yi])), 0, -1)
+
+    def _weights(self, xi, yi):
+        # Site indices and weights for each position, with NaN weights
+        # outside the convex hull.
+        pts = np.column_stack([xi, yi])
+
+        if self.method == 'nearest':
+            _, idx = self.tree.query(pts)
+            return idx[:, np.newaxis], np.ones((len(pts), 1))
+
+        simplex = self.tri.find_simplex(pts)
+        outside = simplex < 0
+        simplex[outside] = 0
+
+        # Barycentric coordinates from the affine transforms.
+        trans = self.tri.transform[simplex]
+        bary = np.einsum('nij,nj->ni', trans[:, :2], pts - trans[:, 2])
+        weights = np.column_stack([bary, 1 - bary.sum(axis=1)])
+        weights[outside] = np.nan
+
+        return self.tri.simplices[simplex], weights
+
+    def _apply_weights(self, z, idx_weights):
+        idx, weights = idx_weights
+        out = (z[..., idx] * weights).sum(axis=-1)
+        if self.method == 'linear':
+            out[..., np.isnan(weights[:, 0])] = self.fill_value
+        return out
 
 
 def example1():
@@ -88,7 +336,7 @@ def example1():
     y = np.array([7, 1, 5, 2])
     z = np.array([10.5, 3.0, 4.5, 30.0])
 
-    im = interp2d(x, y, z, (8, 10))
+    im = interp2d(x, y, z, (8, 10))  # noqa: F841
 
 
 if __name__ == '__main__':
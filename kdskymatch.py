@@ -7,16 +7,572 @@ Brief outline:
        first catalog.
     #. Query the tree for the nearest neighbor from the second catalog.
 
+To match many small catalogs against one deep reference catalog, build
+a `CatalogMatcher` once and query it repeatedly:
+
+>>> matcher = CatalogMatcher(ref.ra, ref.dec, 'ref_image.fits')
+>>> for cat in catalogs:
+...     xmatch, ymatch, xcmatch, ycmatch = matcher.match(
+...         cat.ra, cat.dec, tolerance=4)
+
+For wide fields, or without any WCS, match on the sphere instead. The
+positions become unit 3-vectors and the tolerance is in arcseconds:
+
+>>> matcher = SkyMatcher(ref.ra, ref.dec)
+>>> i_cat, i_ref, sep = matcher.match_nearest(cat.ra, cat.dec, tolerance=1)
+>>> i_cat, i_ref, sep = matcher.match_all(cat.ra, cat.dec, tolerance=1)
+
+To make sure no reference source is matched twice, resolve the ``k``
+nearest candidates of each source by mutual best match:
+
+>>> i_ref, sep, flags = matcher.match_unique(cat.ra, cat.dec, tolerance=1)
+>>> contested = (flags & FLAG_CONTESTED) != 0
+
+For reference catalogs too large for one tree, e.g., memory-mapped
+columns, match declination strip by declination strip and stream the
+pairs to disk:
+
+>>> match_partitioned(cat.ra, cat.dec, ref.ra, ref.dec, tolerance=1,
+...                   outfile='pairs.bin', max_workers=4)
+>>> pairs = np.fromfile('pairs.bin', dtype=PAIR_DTYPE)
+
 """
+# STDLIB
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 # THIRD-PARTY
-from astropy import io
+import numpy as np
 from astropy import wcs as pywcs
+from astropy.io import fits
 from scipy.spatial import cKDTree as KDTree
 
 
 __author__ = 'Harry Ferguson'
 __organization__ = 'Space Telescope Science Institute'
 
+# Matched pair from match_partitioned().
+PAIR_DTYPE = np.dtype([('i_cat', np.int64), ('i_ref', np.int64),
+                       ('sep', np.float64)])
+
+
+# Bit flags from resolve_one_to_one().
+FLAG_CONTESTED = 1    # Nearest reference was also nearest to another source
+FLAG_NOT_NEAREST = 2  # Matched to a reference other than the nearest
+FLAG_MULTIPLE = 4     # More than one reference within tolerance
+FLAG_LOST = 8         # Had candidates but all went to closer sources
+FLAG_TRUNCATED = 16   # All k candidates within tolerance, may be more
+
+
+def resolve_one_to_one(d, i, nref):
+    """
+    Assign each source at most one reference and vice versa.
+
+    In each round, every remaining source picks its closest free
+    candidate and every reference its closest claimant. Pairs that
+    pick each other are kept, and their source and reference are taken
+    out of the remaining candidates. Once a round settles less than a
+    quarter of the remaining candidates, e.g., along a chain of ever
+    larger distances where only one pair settles per round, the rest
+    are taken greedily from the closest in one pass. The result is the
+    same as taking all pairs greedily from the closest, but most of
+    them are settled in a few vectorized rounds.
+    See :func:`benchmark_resolve`.
+
+    Parameters
+    ----------
+    d, i : array_like
+        Distances and reference indices of the ``k`` nearest candidates
+        of each source, with shape ``(nsources, k)``, as from
+        `scipy.spatial.cKDTree.query` with ``distance_upper_bound``.
+        Missing candidates have infinite distance.
+
+    nref : int
+        Number of reference sources.
+
+    Returns
+    -------
+    i_ref : array_like
+        Index of matched reference for each source, -1 if none.
+
+    dist : array_like
+        Distance to matched reference, `numpy.nan` if none.
+
+    flags : array_like
+        Bitmask of ``FLAG_*`` for each source.
+
+    """
+    d = np.asarray(d)
+    i = np.asarray(i)
+    if d.ndim == 1:  # k=1
+        d = d[:, np.newaxis]
+        i = i[:, np.newaxis]
+    nsrc = len(d)
+
+    # Flatten candidates, closest first (ties by source, then by rank).
+    valid = np.isfinite(d)
+    c_src = np.nonzero(valid)[0]
+    c_ref = i[valid]
+    c_d = d[valid]
+    order = np.argsort(c_d, kind='stable')
+    c_src, c_ref, c_d = c_src[order], c_ref[order], c_d[order]
+
+    i_ref = np.full(nsrc, -1, dtype=np.intp)
+    dist = np.full(nsrc, np.nan)
+    src_taken = np.zeros(nsrc, dtype=bool)
+    ref_taken = np.zeros(nref, dtype=bool)
+    alive = np.arange(len(c_d))
+
+    # Position in alive of the closest candidate of each source and
+    # reference. Only entries of the alive ones are used.
+    src_best = np.empty(nsrc, dtype=np.intp)
+    ref_best = np.empty(nref, dtype=np.intp)
+
+    def take(pairs):
+        i_ref[c_src[pairs]] = c_ref[pairs]
+        dist[c_src[pairs]] = c_d[pairs]
+        src_taken[c_src[pairs]] = True
+        ref_taken[c_ref[pairs]] = True
+
+    while len(alive):
+        a_src = c_src[alive]
+        a_ref = c_ref[alive]
+        rank = np.arange(len(alive))
+        src_best[a_src] = len(alive)
+        ref_best[a_ref] = len(alive)
+        np.minimum.at(src_best, a_src, rank)
+        np.minimum.at(ref_best, a_ref, rank)
+        take(alive[(src_best[a_src] == rank) & (ref_best[a_ref] == rank)])
+        nalive = len(alive)
+        alive = alive[~(src_taken[a_src] | ref_taken[a_ref])]
+
+        if len(alive) > 0.75 * nalive:
+            break
+
+    # Greedy pass over the rest, still closest first. Lists index
+    # faster than arrays one element at a time.
+    src_busy = src_taken.tolist()
+    ref_busy = ref_taken.tolist()
+    pairs = []
+    for j, isrc, iref in zip(alive.tolist(), c_src[alive].tolist(),
+                             c_ref[alive].tolist()):
+        if src_busy[isrc] or ref_busy[iref]:
+            continue
+        src_busy[isrc] = ref_busy[iref] = True
+        pairs.append(j)
+    take(np.array(pairs, dtype=np.intp))
+
+    flags = np.zeros(nsrc, dtype=np.uint8)
+    has_cand = valid[:, 0]
+    nearest = i[has_cand, 0]
+    nclaims = np.bincount(nearest, minlength=nref)
+    flags[np.flatnonzero(has_cand)[nclaims[nearest] > 1]] |= FLAG_CONTESTED
+    flags[src_taken & (i_ref != i[:, 0])] |= FLAG_NOT_NEAREST
+    if d.shape[1] > 1:
+        flags[valid[:, 1]] |= FLAG_MULTIPLE
+    flags[has_cand & ~src_taken] |= FLAG_LOST
+    flags[valid[:, -1]] |= FLAG_TRUNCATED
+
+    return i_ref, dist, flags
+
+
+def radec2xyz(ra, dec):
+    """Convert RA,DEC in degrees to contiguous Nx3 unit vectors."""
+    ra = np.radians(np.ravel(ra))
+    dec = np.radians(np.ravel(dec))
+    cosdec = np.cos(dec)
+    return np.ascontiguousarray(np.column_stack(
+        [cosdec * np.cos(ra), cosdec * np.sin(ra), np.sin(dec)]))
+
+
+def arcsec2chord(arcsec):
+    """Convert angular separation in arcsec to chord length on unit sphere."""
+    return 2 * np.sin(np.radians(np.asarray(arcsec) / 7200.0))
+
+
+def chord2arcsec(chord):
+    """Inverse of :func:`arcsec2chord`."""
+    return np.degrees(2 * np.arcsin(np.clip(chord, 0, 2) / 2)) * 3600
+
+
+class SkyMatcher(object):
+    """
+    Match on the sphere against a fixed reference catalog.
+
+    Positions are unit 3-vectors, so there is no projection to
+    distort wide fields and no WCS is needed. A tolerance of
+    angle ``theta`` is a chord of ``2 * sin(theta / 2)``.
+
+    Parameters
+    ----------
+    ra, dec : array_like
+        Reference catalog coordinates in degrees.
+
+    leafsize, balanced_tree, compact_nodes
+        See :class:`CatalogMatcher`.
+
+    Attributes
+    ----------
+    xyz : array_like
+        Nx3 reference unit vectors.
+
+    tree : `scipy.spatial.cKDTree`
+
+    """
+    def __init__(self, ra, dec, leafsize=16, balanced_tree=False,
+                 compact_nodes=False):
+        self.xyz = radec2xyz(ra, dec)
+        self.tree = KDTree(self.xyz, leafsize=leafsize,
+                           balanced_tree=balanced_tree,
+                           compact_nodes=compact_nodes, copy_data=False)
+
+    def query(self, ra, dec, tolerance=1, k=1, workers=-1):
+        """
+        Find the nearest reference source(s) within tolerance.
+
+        Parameters
+        ----------
+        ra, dec : array_like
+            Catalog coordinates in degrees.
+
+        tolerance : number
+            Match tolerance in arcsec.
+
+        k : int
+            Number of nearest reference sources to return.
+
+        workers : int
+            Number of threads for the query. -1 uses all CPUs.
+
+        Returns
+        -------
+        sep : array_like
+            Separation in arcsec, `numpy.inf` if none within tolerance.
+
+        i : array_like
+            Index of the reference source, ``len(self.xyz)``
+            if none within tolerance.
+
+        """
+        d, i = self.tree.query(radec2xyz(ra, dec), k=k,
+                               distance_upper_bound=arcsec2chord(tolerance),
+                               workers=workers)
+        return np.where(np.isinf(d), np.inf, chord2arcsec(d)), i
+
+    def match_nearest(self, ra, dec, tolerance=1, workers=-1):
+        """
+        One-to-one nearest matches within tolerance.
+
+        Each catalog source takes its nearest reference source. When
+        several claim the same reference source, only the closest
+        keeps it.
+
+        Parameters
+        ----------
+        ra, dec, tolerance, workers
+            See :meth:`query`.
+
+        Returns
+        -------
+        i_cat, i_ref : array_like
+            Indices of matched pairs in the given and reference catalogs.
+
+        sep : array_like
+            Separations in arcsec.
+
+        """
+        sep, i_ref = self.query(ra, dec, tolerance=tolerance,
+                                workers=workers)
+        i_cat = np.flatnonzero(np.isfinite(sep))
+
+        # Closest first, then keep the first claim on each reference.
+        i_cat = i_cat[np.argsort(sep[i_cat], kind='stable')]
+        _, first = np.unique(i_ref[i_cat], return_index=True)
+        i_cat = np.sort(i_cat[first])
+
+        return i_cat, i_ref[i_cat], sep[i_cat]
+
+    def match_unique(self, ra, dec, tolerance=1, k=4, workers=-1):
+        """
+        One-to-one matches from the ``k`` nearest candidates.
+
+        See :func:`resolve_one_to_one`.
+
+        Parameters
+        ----------
+        ra, dec, tolerance, k, workers
+            See :meth:`query`.
+
+        Returns
+        -------
+        i_ref : array_like
+            Index of matched reference for each given source, -1 if none.
+
+        sep : array_like
+            Separation in arcsec, `numpy.nan` if none.
+
+        flags : array_like
+            Bitmask of ``FLAG_*`` for each given source.
+
+        """
+        sep, i = self.query(ra, dec, tolerance=tolerance, k=k,
+                            workers=workers)
+        return resolve_one_to_one(sep, i, len(self.xyz))
+
+    def match_all(self, ra, dec, tolerance=1):
+        """
+        All pairs within tolerance.
+
+        Parameters
+        ----------
+        ra, dec, tolerance
+            See :meth:`query`.
+
+        Returns
+        -------
+        i_cat, i_ref, sep
+            See :meth:`match_nearest`. Sorted by ``i_cat``, then ``i_ref``.
+
+        """
+        tree = KDTree(radec2xyz(ra, dec))
+        pairs = tree.sparse_distance_matrix(
+            self.tree, arcsec2chord(tolerance), output_type='ndarray')
+        pairs.sort(order=['i', 'j'])
+        return pairs['i'], pairs['j'], chord2arcsec(pairs['v'])
+
+
+def match_partitioned(ra, dec, ref_ra, ref_dec, tolerance=1, outfile=None,
+                      strip_rows=2**20, max_workers=None):
+    """
+    All pairs within tolerance, matched in declination strips.
+
+    The reference catalog is cut into strips of ``strip_rows``
+    sources by declination. Each strip is matched with
+    :meth:`SkyMatcher.match_all` against the catalog sources within
+    ``tolerance`` of its declination range. A pair belongs to the
+    strip of its reference source, so each pair is found exactly once
+    and the result is the same set of pairs as a global match.
+    Only one strip of each catalog is in memory at a time, apart from
+    the declination sort order.
+
+    Parameters
+    ----------
+    ra, dec : array_like
+        Catalog coordinates in degrees.
+
+    ref_ra, ref_dec : array_like
+        Reference catalog coordinates in degrees. These can be
+        memory-mapped.
+
+    tolerance : number
+        Match tolerance in arcsec.
+
+    outfile : str or `None`
+        If given, raw records of `PAIR_DTYPE` are appended to this file
+        as each strip finishes and a read-only `numpy.memmap` of it is
+        returned. Otherwise, pairs are returned in memory.
+
+    strip_rows : int
+        Number of reference sources per strip.
+
+    max_workers : int or `None`
+        Match strips in this many threads. If `None`, strips are
+        done serially.
+
+    Returns
+    -------
+    pairs : array_like
+        Records of `PAIR_DTYPE`, grouped by strip in order of
+        declination and sorted by ``i_cat``, then ``i_ref``, within
+        each strip.
+
+    """
+    # Angular separation is never less than the declination difference.
+    margin = tolerance / 3600.0 * (1 + 1e-9)
+
+    # Memory-mapped input stays memory-mapped.
+    ra, dec, ref_ra, ref_dec = map(np.asarray, (ra, dec, ref_ra, ref_dec))
+
+    ref_order = np.argsort(ref_dec, kind='stable')
+    cat_order = np.argsort(dec, kind='stable')
+    cat_dec = dec[cat_order]
+
+    def match_strip(r1):
+        # Fancy indexing in sorted order reads memmaps sequentially.
+        i_ref = ref_order[r1:r1 + strip_rows]
+        i_ref_sorted = np.sort(i_ref)
+        s_dec = ref_dec[i_ref_sorted]
+        c1, c2 = np.searchsorted(cat_dec, [s_dec.min() - margin,
+                                           s_dec.max() + margin])
+        i_cat = np.sort(cat_order[c1:c2])
+
+        matcher = SkyMatcher(ref_ra[i_ref_sorted], s_dec)
+        j_cat, j_ref, sep = matcher.match_all(
+            ra[i_cat], dec[i_cat], tolerance=tolerance)
+
+        pairs = np.empty(len(sep), dtype=PAIR_DTYPE)
+        pairs['i_cat'] = i_cat[j_cat]
+        pairs['i_ref'] = i_ref_sorted[j_ref]
+        pairs['sep'] = sep
+        return pairs
+
+    starts = range(0, len(ref_order), strip_rows)
+    if max_workers is None:
+        results = map(match_strip, starts)
+    else:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        results = executor.map(match_strip, starts)
+
+    try:
+        if outfile is None:
+            return np.concatenate(
+                [np.empty(0, dtype=PAIR_DTYPE)] + list(results))
+
+        with open(outfile, 'wb') as fout:
+            for pairs in results:
+                pairs.tofile(fout)
+    finally:
+        if max_workers is not None:
+            executor.shutdown()
+
+    if os.path.getsize(outfile) == 0:  # Cannot memmap empty file
+        return np.empty(0, dtype=PAIR_DTYPE)
+    return np.memmap(outfile, dtype=PAIR_DTYPE, mode='r')
+
+
+class CatalogMatcher(object):
+    """
+    Nearest-neighbor matcher against a fixed reference catalog.
+
+    The WCS and the KD-tree are built once, so each query only
+    pays for the conversion and search of the new catalog.
+
+    Parameters
+    ----------
+    ra, dec : array_like
+        Reference catalog coordinates in degrees.
+
+    fits_image : str or `astropy.wcs.WCS`
+        FITS image (primary header) or WCS for conversion of
+        RA,DEC to X,Y.
+
+    leafsize : int
+        See `scipy.spatial.cKDTree`.
+
+    balanced_tree, compact_nodes : bool
+        See `scipy.spatial.cKDTree`. Both default to `False` here,
+        which builds a deep catalog several times faster with little
+        cost for the many small queries.
+
+    Attributes
+    ----------
+    wcs : `astropy.wcs.WCS`
+
+    xy : array_like
+        Nx2 reference X,Y positions.
+
+    tree : `scipy.spatial.cKDTree`
+
+    """
+    def __init__(self, ra, dec, fits_image, leafsize=16, balanced_tree=False,
+                 compact_nodes=False):
+        if isinstance(fits_image, pywcs.WCS):
+            self.wcs = fits_image
+        else:
+            with fits.open(fits_image) as hdu:
+                self.wcs = pywcs.WCS(hdu['PRIMARY'].header)
+
+        self.xy = self.world2pix(ra, dec)
+        self.tree = KDTree(self.xy, leafsize=leafsize,
+                           balanced_tree=balanced_tree,
+                           compact_nodes=compact_nodes, copy_data=False)
+
+    def world2pix(self, ra, dec):
+        """Convert RA,DEC to contiguous Nx2 X,Y array."""
+        x, y = self.wcs.wcs_world2pix(np.ravel(ra), np.ravel(dec), 0)
+        return np.ascontiguousarray(np.column_stack([x, y]))
+
+    def query(self, ra, dec, tolerance=4, k=1, workers=-1):
+        """
+        Find the nearest reference source(s) within tolerance.
+
+        Parameters
+        ----------
+        ra, dec : array_like
+            Catalog coordinates in degrees.
+
+        tolerance : number
+            Match tolerance in pixels.
+
+        k : int
+            Number of nearest reference sources to return.
+
+        workers : int
+            Number of threads for the query. -1 uses all CPUs.
+
+        Returns
+        -------
+        d : array_like
+            Distance in pixels to the nearest reference source,
+            `numpy.inf` if none within tolerance.
+
+        i : array_like
+            Index of the nearest reference source, ``len(self.xy)``
+            if none within tolerance.
+
+        """
+        return self.tree.query(self.world2pix(ra, dec), k=k,
+                               distance_upper_bound=tolerance,
+                               workers=workers)
+
+    def match_unique(self, ra, dec, tolerance=4, k=4, workers=-1):
+        """
+        One-to-one matches from the ``k`` nearest candidates.
+
+        See :func:`resolve_one_to_one`.
+
+        Parameters
+        ----------
+        ra, dec, tolerance, k, workers
+            See :meth:`query`.
+
+        Returns
+        -------
+        i_ref, dist, flags
+            See :func:`resolve_one_to_one`. Distances are in pixels.
+
+        """
+        d, i = self.query(ra, dec, tolerance=tolerance, k=k, workers=workers)
+        return resolve_one_to_one(d, i, len(self.xy))
+
+    def match(self, ra, dec, tolerance=4, workers=-1):
+        """
+        Parameters
+        ----------
+        ra, dec, tolerance, workers
+            See :meth:`query`.
+
+        Returns
+        -------
+        xmatch, ymatch
+            Matched X,Y from reference catalog.
+
+        xcmatch, ycmatch
+            Matched X,Y from given catalog.
+
+        """
+        xy = self.world2pix(ra, dec)
+        d, i = self.tree.query(xy, k=1, distance_upper_bound=tolerance,
+                               workers=workers)
+
+        # Give me just the matchers within a tolerance
+        j = d < tolerance
+        ii = i[j]
+        xmatch, ymatch = self.xy[ii].T
+        xcmatch, ycmatch = xy[j].T
+
+        return xmatch, ymatch, xcmatch, ycmatch
+
 
 def match(s, h, fits_image, tolerance=4):
     """
@@ -45,25 +601,91 @@ def match(s, h, fits_image, tolerance=4):
     # long as you use the same for both data sets it's not really important
     # what the projection is. In my case I read in a fits image associated
     # with the first catalog and use that header info.
-    hdu = io.fits.open(fits_image)
-    wcs = pywcs.WCS(hdu['PRIMARY'].header)
+    matcher = CatalogMatcher(s.ra, s.dec, fits_image)
+    return matcher.match(h.ra, h.dec, tolerance=tolerance)
+
+
+def benchmark_resolve(nsrc=200000, k=4, nchain=20000, repeat=3, seed=0):
+    """
+    Time :func:`resolve_one_to_one` against a plain greedy loop.
+
+    Two cases are timed:
+
+    * ``'random'``: ``nsrc`` random sources against as many random
+      references, with a tolerance of about two mean spacings.
+    * ``'chain'``: ``nchain`` sources, each with candidates at
+      ever larger distances, so only one mutual best pair settles in
+      each vectorized round.
+
+    Parameters
+    ----------
+    nsrc, k : int
+        Number of sources and candidates for ``'random'``.
+
+    nchain : int
+        Number of sources for ``'chain'``.
+
+    repeat : int
+        Best of this many runs is reported.
+
+    seed : int
+        Seed for ``'random'``.
+
+    Returns
+    -------
+    timings : dict
+        Best time in seconds for each case and implementation.
+
+    """
+    import timeit
+
+    rng = np.random.default_rng(seed)
+    ref = rng.random((nsrc, 2))
+    cat = rng.random((nsrc, 2))
+    d, i = KDTree(ref).query(cat, k=k,
+                             distance_upper_bound=2 / np.sqrt(nsrc))
+
+    # Source j has reference j at 2j and reference j+1 at 2j+1, which
+    # source j+1 claims at 2j+2.
+    s = np.arange(nchain)
+    d_chain = np.column_stack([2.0 * s, 2.0 * s + 1])
+    i_chain = np.column_stack([s, s + 1])
+
+    # Reference: take candidates one by one, closest first.
+    def greedy(d, i, nref):
+        valid = np.isfinite(d)
+        c_src = np.nonzero(valid)[0]
+        c_ref = i[valid]
+        c_d = d[valid]
+        order = np.argsort(c_d, kind='stable')
 
-    # Convert sky to x,y positions
-    x, y = wcs.wcs_world2pix(s.ra, s.dec, 0)
-    xh, yh = wcs.wcs_world2pix(h.ra, h.dec, 0)
+        i_ref = [-1] * len(d)
+        dist = [np.nan] * len(d)
+        ref_taken = [False] * nref
+        for isrc, iref, dd in zip(c_src[order].tolist(),
+                                  c_ref[order].tolist(),
+                                  c_d[order].tolist()):
+            if i_ref[isrc] >= 0 or ref_taken[iref]:
+                continue
+            i_ref[isrc] = iref
+            dist[isrc] = dd
+            ref_taken[iref] = True
 
-    # Create a KD Tree
-    tree = KDTree(zip(x.ravel(), y.ravel()))
+        return np.array(i_ref), np.array(dist)
 
-    # Search it for the nearest neighbor
-    # d = distance of the nearest neighbor
-    # i = index in x,y arrays of the nearest neighbor for each source in xh,yh
-    d, i = tree.query(zip(xh.ravel(), yh.ravel()), k=1)
+    timings = {}
+    for case, args in (('random', (d, i, nsrc)),
+                       ('chain', (d_chain, i_chain, nchain + 1))):
+        for key, func in (('greedy loop', greedy),
+                          ('resolve_one_to_one', resolve_one_to_one)):
+            key = '{} {}'.format(case, key)
+            timings[key] = min(timeit.repeat(lambda: func(*args), number=1,
+                                             repeat=repeat))
+            print('{}: {:.4f} s'.format(key, timings[key]))
 
-    # Give me just the matchers within a tolerance
-    j = d < tolerance
-    ii = i[j]  # match within N pixels; tricker to do this in ra,dec
-    xmatch, ymatch = x[ii], y[ii]
-    xhmatch, yhmatch = xh[j], yh[j]
+        expected = greedy(*args)
+        result = resolve_one_to_one(*args)
+        np.testing.assert_array_equal(result[0], expected[0])
+        np.testing.assert_array_equal(result[1], expected[1])
 
-    return xmatch, ymatch, xhmatch, yhmatch
+    return timings
@@ -40,6 +40,7 @@ This took 10.0 seconds.
  'jw01052_20250316t101635_pool.csv': 57}
 
 """
+import heapq
 import os
 import re
 import time
@@ -49,11 +50,62 @@ from glob import iglob
 import numpy as np
 from astropy.table import Table
 
-__all__ = ["do_match", "match_criteria", "sneakpeek", "apply_filters"]
+__all__ = ["do_match", "do_match_many", "warm_cache", "match_criteria",
+           "sneakpeek", "apply_filters", "MatchResults"]
+
+# Reward for matching values in a given column; unlisted columns get 1.
+_SCOREBOARD = {
+    "ASN_CANDIDATE": 1000,
+    "BAND": 500,
+    "CHANNEL": 500,
+    "DETECTOR": 1000,
+    "EXP_TYPE": 1500,
+    "FILTER": 500,
+    "FXD_SLIT": 500,
+    "GRATING": 500,
+    "INSTRUME": 1000,
+    "PATTTYPE": 500,
+    "PUPIL": 500,
+    "SPAT_NUM": 100,
+    "SPEC_NUM": 100,
+    "SUBARRAY": 100,
+    "TEMPLATE": 1000,
+    "TSOVISIT": 1000,
+}
+
+# Association candidate types, e.g., GROUP in "[('C1000', 'GROUP')]".
+_RPATT_ASN_CAND = re.compile(r", '(\w*)'")
+
+# EXP_TYPE for calibration programs.
+_CAL_EXPTYPES = frozenset([
+    # FGS
+    "FGS_ACQ1", "FGS_ACQ2", "FGS_FINEGUIDE", "FGS_ID-IMAGE",
+    "FGS_ID-STACK", "FGS_TRACK",
+    # MIRI
+    "MIR_4QPM", "MIR_CORONCAL", "MIR_DARKALL", "MIR_DARKIMG",
+    "MIR_DARKMRS", "MIR_FLATIMAGE", "MIR_FLATIMAGE-EXT",
+    "MIR_FLATMRS", "MIR_FLATMRS-EXT",
+    # NIRCAM
+    "NRC_DARK", "NRC_FLAT", "NRC_FOCUS", "NRC_LED", "NRC_WFSC",
+    # NIRISS
+    "NIS_DARK", "NIS_EXTCAL", "NIS_FOCUS", "NIS_LAMP",
+    # NIRSPEC
+    "NRS_AUTOFLAT", "NRS_AUTOWAVE", "NRS_CONFIRM", "NRS_DARK",
+    "NRS_FOCUS", "NRS_IMAGE", "NRS_LAMP", "NRS_MIMF", "NRS_VERIFY"
+])
+
+# Penalty for mismatched values in a given column; unlisted columns get 1.
+_NO_MATCH_PENALTY = {
+    "DETECTOR": 1000,
+    "EXP_TYPE": 1000,
+    "INSTRUME": 1000,
+    "TEMPLATE": 1000,
+    "TSOVISIT": 1000,
+}
 
 
 def do_match(fn_old, candidates_patt="jw*.csv", match_type="exact",
-             max_nrows=500, verbose=True, debug=False):
+             max_nrows=500, top_k=None, verbose=True, debug=False):
     """Given pool file to replace from candidates, find best match.
 
     Parameters
@@ -79,6 +131,15 @@ def do_match(fn_old, candidates_patt="jw*.csv", match_type="exact",
         Skip candidates with more than this number of rows to avoid
         choosing a large program.
 
+    top_k : int or `None`
+        If given, only keep the best ``top_k`` candidates (and their
+        details) in a bounded heap while streaming through the
+        candidates, so memory stays flat for huge archives.
+        Ties are resolved in favor of the candidate seen first,
+        same as ``score.most_common(top_k)`` would without this.
+        :func:`sneakpeek` and :func:`apply_filters` then only see
+        the kept candidates. If `None`, keep everything.
+
     verbose : bool
         Print informational text.
 
@@ -94,69 +155,153 @@ def do_match(fn_old, candidates_patt="jw*.csv", match_type="exact",
         Maps each possible replacement filename to full comparison
         details by common column names.
 
+    See Also
+    --------
+    do_match_many
+
     """
-    t_old = Table.read(fn_old, delimiter="|", format="ascii")
-    d_scores = Counter()
-    d_details = {}
+    d_scores, d_details = do_match_many(
+        [fn_old], candidates_patt=candidates_patt, match_type=match_type,
+        max_nrows=max_nrows, top_k=top_k, verbose=verbose, debug=debug)
+    return d_scores[fn_old], d_details[fn_old]
 
-    # Force uppercase column names to ensure match with inflight data.
-    t_old.rename_columns(
-        t_old.colnames, list(map(str.upper, t_old.colnames)))
 
-    # Known irrelevant pools or calibration programs to ignore.
-    is_cal_old, progs_to_ignore = _get_progs_to_ignore(
-        t_old["EXP_TYPE"], verbose=verbose)
+def do_match_many(fn_olds, candidates_patt="jw*.csv", match_type="exact",
+                  max_nrows=500, top_k=None, cache=None, verbose=True,
+                  debug=False):
+    """Like :func:`do_match` but for many pool files to replace at once.
 
-    if candidates_patt.endswith(".txt") and os.path.isfile(candidates_patt):
-        with open(candidates_patt) as flist_in:
-            fn_list = [s.strip() for s in flist_in.readlines()]
-    else:
-        fn_list = iglob(candidates_patt)
+    Each candidate is read and parsed only once, then scored against
+    all the old pools in the same pass. The results are the same as
+    calling :func:`do_match` for each old pool separately.
+
+    Parameters
+    ----------
+    fn_olds : list of str
+        Filenames of the CSV to be replaced.
+        Provide full path if not in working directory.
+
+    candidates_patt, match_type, max_nrows, top_k, verbose, debug
+        See :func:`do_match`.
+
+    cache : dict or `None`
+        Parsed candidates keyed by filename, as returned by
+        :func:`warm_cache`. Entries are checked against the file
+        modification time and size, so changed candidates are parsed
+        again and new ones are added. Pass the same dict to later calls
+        to avoid re-reading unchanged candidates. If `None`, nothing
+        is cached.
+
+    Returns
+    -------
+    d_scores : dict
+        Maps each filename in ``fn_olds`` to its ranked matches
+        (:py:class:`~collections.Counter` of filenames with scores).
+
+    d_details : dict
+        Maps each filename in ``fn_olds`` to its comparison details,
+        as returned by :func:`do_match`.
+
+    Examples
+    --------
+    >>> d_scores, d_details = do_match_many(
+    ...     ['pool_002_image_miri.csv', 'pool_003_image_miri.csv'],
+    ...     candidates_patt=patt)
+    >>> d_scores['pool_002_image_miri.csv'].most_common(1)
+    [('/another/path/to/jw05204_20250308t202944_pool.csv', 6560)]
+
+    """
+    if top_k is not None and top_k < 1:
+        raise ValueError(f"top_k must be positive but got {top_k}")
+
+    # (fn_old, nrows, value sets, is_cal, progs_to_ignore)
+    olds = []
+    for fn_old in fn_olds:
+        t_old = _read_pool(fn_old)
+
+        # Known irrelevant pools or calibration programs to ignore.
+        is_cal_old, progs_to_ignore = _get_progs_to_ignore(
+            t_old["EXP_TYPE"], verbose=verbose)
+
+        olds.append((fn_old, len(t_old), _value_sets(t_old),
+                     is_cal_old, progs_to_ignore))
+
+    d_scores = {fn_old: Counter() for fn_old in fn_olds}
+    d_details = {fn_old: {} for fn_old in fn_olds}
+    top_heaps = {fn_old: [] for fn_old in fn_olds}  # Only used for top_k
+
+    fn_list = _list_candidates(candidates_patt)
 
     if verbose:
         t_start = time.time()
 
-    for fn_cur in fn_list:
-        if fn_cur == fn_old:
-            continue
-
-        prognum = _get_prog(fn_cur)
+    for i_cur, fn_cur in enumerate(fn_list):
+        try:
+            prognum = _get_prog(fn_cur)
+        except ValueError:
+            # An old pool found among the candidates need not be named
+            # like a program pool; it is skipped for itself anyway.
+            if fn_cur in d_scores:
+                continue
+            raise
         if prognum <= 1000 or prognum >= 10000:
             if debug:
                 print(f"Skipping non-flight program {prognum}: {fn_cur}")
             continue
 
-        ignore_this = False
-        for bad_prog in progs_to_ignore:
-            if bad_prog in fn_cur:
-                ignore_this = True
+        # Only old pools that would not skip this file by name.
+        wanted = []
+        for old in olds:
+            fn_old, progs_to_ignore = old[0], old[4]
+            if fn_cur == fn_old:
+                continue
+            bad_prog = _find_bad_prog(fn_cur, progs_to_ignore)
+            if bad_prog:
                 if debug:
                     print(f"Skipping bad program {bad_prog}: {fn_cur}")
-                break
-        if ignore_this:
+                continue
+            wanted.append(old)
+        if not wanted:
             continue
 
-        t_cur = Table.read(fn_cur, delimiter="|", format="ascii")
+        if cache is None:
+            t_cur = _read_pool(fn_cur)
+            nrows = len(t_cur)
+        else:
+            nrows, is_cal_cur, sets_cur = _cached_candidate(fn_cur, cache)
 
-        nrows = len(t_cur)
         if nrows == 0 or nrows > max_nrows:
             if debug:
                 print(f"Skipping nrows={nrows}: {fn_cur}")
             continue
 
-        # Force uppercase column names to ensure match with input data.
-        t_cur.rename_columns(
-            t_cur.colnames, list(map(str.upper, t_cur.colnames)))
+        if cache is None:
+            is_cal_cur = _is_cal(t_cur["EXP_TYPE"])
+            sets_cur = None  # Parsed once, shared by all old pools
+        sorted_cache = {}
 
-        is_cal_cur = _is_cal(t_cur["EXP_TYPE"])
-        if is_cal_cur is not is_cal_old:
-            if debug:
-                print(f"Skipping {is_cal_cur}!={is_cal_old}: {fn_cur}")
-            continue
-
-        score, details = match_criteria(t_old, t_cur, match_type=match_type)
-        d_scores[fn_cur] = score
-        d_details[fn_cur] = details
+        for fn_old, nrows_old, sets_old, is_cal_old, _ in wanted:
+            if is_cal_cur is not is_cal_old:
+                if debug:
+                    print(f"Skipping {is_cal_cur}!={is_cal_old}: {fn_cur}")
+                continue
+
+            if sets_cur is None:
+                sets_cur = _value_sets(t_cur)
+
+            score, details = _score_sets(
+                nrows_old, sets_old, nrows, sets_cur, match_type=match_type,
+                sorted_cache=sorted_cache)
+            _keep_match(d_scores[fn_old], d_details[fn_old],
+                        top_heaps[fn_old], top_k, i_cur, fn_cur,
+                        score, details)
+
+    for fn_old in fn_olds:
+        # Insert best first so ties keep their original ranking.
+        for score, _, fn_cur, details in sorted(top_heaps[fn_old],
+                                                reverse=True):
+            d_scores[fn_old][fn_cur] = score
+            d_details[fn_old][fn_cur] = details
 
     if verbose:
         t_end = time.time()
@@ -165,69 +310,58 @@ def do_match(fn_old, candidates_patt="jw*.csv", match_type="exact",
     return d_scores, d_details
 
 
-def match_criteria(t_old, t_candidate, match_type="exact"):
-    """Higher number is better."""
-    score = len(t_old) - len(t_candidate)
-    details = {"nrows": (len(t_old), len(t_candidate))}
-    common_colnames = sorted(set(t_old.colnames) & set(t_candidate.colnames))
-    asn_cand_old = _unique_asn_cand_types(t_old["ASN_CANDIDATE"])
-    scoreboard = {
-        "ASN_CANDIDATE": 1000,
-        "BAND": 500,
-        "CHANNEL": 500,
-        "DETECTOR": 1000,
-        "EXP_TYPE": 1500,
-        "FILTER": 500,
-        "FXD_SLIT": 500,
-        "GRATING": 500,
-        "INSTRUME": 1000,
-        "PATTTYPE": 500,
-        "PUPIL": 500,
-        "SPAT_NUM": 100,
-        "SPEC_NUM": 100,
-        "SUBARRAY": 100,
-        "TEMPLATE": 1000,
-        "TSOVISIT": 1000,
-    }
-    no_match_penalty = {
-        "DETECTOR": 1000,
-        "EXP_TYPE": 1000,
-        "INSTRUME": 1000,
-        "TEMPLATE": 1000,
-        "TSOVISIT": 1000,
-    }
-
-    for colname in common_colnames:
-        # Not useful and clutter output.
-        if colname in ("FILENAME", "OBS_ID", "VISIT_ID"):
-            continue
+def warm_cache(candidates_patt="jw*.csv", cache=None, verbose=True):
+    """Parse all flight program candidates for :func:`do_match_many`.
 
-        if colname == "ASN_CANDIDATE":
-            s1 = asn_cand_old
-            s2 = _unique_asn_cand_types(t_candidate[colname])
+    Parameters
+    ----------
+    candidates_patt : str
+        See :func:`do_match`.
 
-        else:
-            if t_old[colname].dtype.type is np.str_:
-                c_old = list(map(str.upper, t_old[colname]))
-            else:
-                c_old = t_old[colname].tolist()
+    cache : dict or `None`
+        Existing cache to refresh in-place. Candidates that no longer
+        match ``candidates_patt`` are dropped from it.
+        If `None`, a new one is created.
 
-            if t_candidate[colname].dtype.type is np.str_:
-                c_cur = list(map(str.upper, t_candidate[colname]))
-            else:
-                c_cur = t_candidate[colname].tolist()
+    verbose : bool
+        Print informational text.
 
-            s1 = set(c_old)
-            s2 = set(c_cur)
+    Returns
+    -------
+    cache : dict
+        Parsed candidates keyed by filename.
 
-        if ((match_type == "exact" and s1 == s2) or
-                (match_type == "subset" and s1 <= s2)):
-            score += scoreboard.get(colname, 1)
-        else:
-            score -= no_match_penalty.get(colname, 1)
-        details[colname] = (sorted(s1), sorted(s2))
+    """
+    if cache is None:
+        cache = {}
 
-    return score, details
+    if verbose:
+        t_start = time.time()
+
+    fn_list = set()
+    for fn_cur in _list_candidates(candidates_patt):
+        prognum = _get_prog(fn_cur)
+        if prognum <= 1000 or prognum >= 10000:
+            continue
+        fn_list.add(fn_cur)
+        _cached_candidate(fn_cur, cache)
+
+    for fn_cur in set(cache) - fn_list:
+        del cache[fn_cur]
+
+    if verbose:
+        t_end = time.time()
+        print(f"Cached {len(cache)} candidates in "
+              f"{t_end - t_start:.1f} seconds.")
+
+    return cache
+
+
+def match_criteria(t_old, t_candidate, match_type="exact"):
+    """Higher number is better."""
+    return _score_sets(len(t_old), _value_sets(t_old),
+                       len(t_candidate), _value_sets(t_candidate),
+                       match_type=match_type)
 
 
 def sneakpeek(score, details, key, most_common=5):
@@ -248,6 +382,9 @@ def apply_filters(score, details, filters):
     """Filters are a list of ``(key, val)``
     where ``val`` is in one of the values.
 
+    For repeated filtering of the same results, build
+    :class:`MatchResults` once and use its ``select`` method instead.
+
     Examples
     --------
     >>> apply_filters(score, details, [
@@ -256,63 +393,316 @@ def apply_filters(score, details, filters):
     ...     ('EXP_TYPE', 'MIR_LRS-FIXEDSLIT')])
 
     """
-    matches = []
+    if not filters:
+        return []
+
+    return MatchResults(score, details).select(filters)["filename"].tolist()
+
+
+class MatchResults:
+    """Columnar store of match results for fast filtering.
+
+    There is one row per candidate, in ranked order, with its
+    filename, score, number of rows, and sorted candidate values
+    for each compared column (as tuple; empty if not compared).
+    Filters are evaluated as boolean masks over all the rows.
+
+    Parameters
+    ----------
+    score, details
+        Output from :func:`do_match`.
+
+    Attributes
+    ----------
+    table : `~astropy.table.Table`
+        The columnar results.
+
+    Examples
+    --------
+    >>> res = MatchResults(score, details)
+    >>> res.select([('ASN_CANDIDATE', 'BACKGROUND')], sort_by='nrows',
+    ...            descending=False, limit=10)
+    <Table length=10>
+    ...
+
+    """
+
+    def __init__(self, score, details):
+        ranked = score.most_common()
+        fn_list = [fn for fn, _ in ranked]
+        colnames = sorted({key for fn in fn_list for key in details[fn]
+                           if key != "nrows"})
+
+        self.table = Table()
+        self.table["filename"] = fn_list
+        self.table["score"] = np.array([val for _, val in ranked], dtype=int)
+        self.table["nrows"] = np.array(
+            [details[fn]["nrows"][1] for fn in fn_list], dtype=int)
+
+        for colname in colnames:
+            col = np.empty(len(fn_list), dtype=object)
+            col[:] = [tuple(details[fn][colname][1])
+                      if colname in details[fn] else () for fn in fn_list]
+            self.table[colname] = col
+
+        # Built on first use: colname -> {value: row indices}
+        self._index = {}
+
+    def __len__(self):
+        return len(self.table)
+
+    def mask(self, filters):
+        """Boolean mask of rows passing all the filters.
+
+        Parameters
+        ----------
+        filters : list of tuple
+            ``(key, val)`` pairs, as in :func:`apply_filters`.
+            For ``'nrows'`` and ``'score'``, the value must be equal;
+            otherwise, it must be one of the candidate values.
+
+        Returns
+        -------
+        mask : array of bool
+
+        """
+        mask = np.ones(len(self), dtype=bool)
 
-    for match_tuple in score.most_common():
-        scoreboard = []
-        fn = match_tuple[0]
-        d = details[fn]
         for key, val in filters:
-            status = False
-            detail = d[key][1]
-            if key == 'nrows':
-                if val == detail:
-                    status = True
-            elif val in detail:
-                status = True
-            scoreboard.append(status)
-        if scoreboard and np.all(scoreboard):
-            matches.append(fn)
+            if key in ("nrows", "score"):
+                mask &= self.table[key] == val
+                continue
+
+            if key not in self.table.colnames:
+                mask[:] = False
+                break
+
+            rows = self._get_index(key).get(val)
+            cur_mask = np.zeros(len(self), dtype=bool)
+            if rows is not None:
+                cur_mask[rows] = True
+            mask &= cur_mask
+
+        return mask
+
+    def select(self, filters=(), sort_by="score", descending=True, offset=0,
+               limit=None):
+        """Rows passing all the filters, sorted and paginated.
+
+        Parameters
+        ----------
+        filters : list of tuple
+            See :meth:`mask`. If empty, all rows pass.
+
+        sort_by : {'score', 'nrows', 'filename'}
+            Column to sort by. Ties keep their ranked order.
+
+        descending : bool
+            Sort in descending order.
+
+        offset, limit : int
+            Skip the first ``offset`` rows after sorting and return
+            at most ``limit`` rows. If ``limit`` is `None`, return
+            the rest.
+
+        Returns
+        -------
+        tab : `~astropy.table.Table`
+
+        """
+        rows = np.flatnonzero(self.mask(filters))
+        col = np.asarray(self.table[sort_by])[rows]
+
+        if descending:
+            # Reversed stable sort, reversed back, keeps ties in rank order.
+            order = (len(rows) - 1 - np.argsort(col[::-1], kind="stable"))[::-1]
+        else:
+            order = np.argsort(col, kind="stable")
+
+        stop = None if limit is None else offset + limit
+        return self.table[rows[order][offset:stop]]
+
+    def _get_index(self, colname):
+        if colname not in self._index:
+            index = {}
+            for i, vals in enumerate(self.table[colname]):
+                for val in vals:
+                    index.setdefault(val, []).append(i)
+            self._index[colname] = {
+                val: np.array(rows, dtype=int) for val, rows in index.items()}
+        return self._index[colname]
+
+
+def benchmark_parsing(nrows=500, number=200):
+    """Time per-cell vs column-level parsing of a fake pool.
+
+    The fake ``ASN_CANDIDATE`` and ``EXP_TYPE`` columns look like
+    what is found in a typical science pool.
+
+    Parameters
+    ----------
+    nrows : int
+        Number of rows in the fake pool.
+
+    number : int
+        Number of calls to time for each implementation.
+
+    Returns
+    -------
+    timings : dict
+        Seconds per call for each implementation.
+
+    """
+    import timeit
+
+    asn_col = [f"[('o{i % 50:03d}', 'OBSERVATION'), ('c{1000 + i % 7}', "
+               f"'{('GROUP', 'BACKGROUND', 'COORDINATED')[i % 3]}')]"
+               for i in range(nrows)]
+    # Science pool, so the old implementation has to scan the whole list.
+    exptype_col = ["mir_image", "mir_lrs-fixedslit"] * (nrows // 2)
+    cal_exptype_list = sorted(_CAL_EXPTYPES)
+
+    def old_asn():
+        output_set = set()
+        for cell in asn_col:
+            m = re.findall(r", '(\w*)'", cell)
+            if m:
+                output_set |= set(sorted(m))
+        return output_set
+
+    def old_is_cal():
+        for val in exptype_col:
+            if val.upper() in cal_exptype_list:
+                return True
+        return False
+
+    def new_asn():
+        return _unique_asn_cand_types(asn_col)
+
+    def new_is_cal():
+        return _is_cal(exptype_col)
+
+    assert old_asn() == new_asn()
+    assert old_is_cal() is new_is_cal()
+
+    timings = {}
+    for key, func in (("ASN_CANDIDATE per-cell", old_asn),
+                      ("ASN_CANDIDATE column", new_asn),
+                      ("EXP_TYPE list", old_is_cal),
+                      ("EXP_TYPE frozenset", new_is_cal)):
+        timings[key] = timeit.timeit(func, number=number) / number
+        print(f"{key}: {timings[key] * 1e6:.1f} us")
+
+    return timings
+
+
+def _list_candidates(candidates_patt):
+    if candidates_patt.endswith(".txt") and os.path.isfile(candidates_patt):
+        with open(candidates_patt) as flist_in:
+            fn_list = [s.strip() for s in flist_in.readlines()]
+    else:
+        fn_list = iglob(candidates_patt)
+    return fn_list
+
+
+def _cached_candidate(fn, cache):
+    # Returns (nrows, is_cal, value sets), re-parsing only if file changed.
+    st = os.stat(fn)
+    stamp = (st.st_mtime_ns, st.st_size)
+    entry = cache.get(fn)
+    if entry is None or entry[0] != stamp:
+        t = _read_pool(fn)
+        entry = (stamp, len(t), _is_cal(t["EXP_TYPE"]), _value_sets(t))
+        cache[fn] = entry
+    return entry[1:]
+
+
+def _read_pool(fn):
+    t = Table.read(fn, delimiter="|", format="ascii")
+
+    # Force uppercase column names to ensure match with inflight data.
+    t.rename_columns(t.colnames, list(map(str.upper, t.colnames)))
+
+    return t
+
+
+def _value_sets(t):
+    # Unique values of each column to compare, only computed once per table.
+    sets = {}
+
+    for colname in t.colnames:
+        # Not useful and clutter output.
+        if colname in ("FILENAME", "OBS_ID", "VISIT_ID"):
+            continue
+
+        if colname == "ASN_CANDIDATE":
+            sets[colname] = _unique_asn_cand_types(t[colname])
+        elif t[colname].dtype.type is np.str_:
+            sets[colname] = set(map(str.upper, t[colname]))
+        else:
+            sets[colname] = set(t[colname].tolist())
+
+    return sets
+
+
+def _score_sets(nrows_old, sets_old, nrows_cur, sets_cur, match_type="exact",
+                sorted_cache=None):
+    # Higher number is better. sorted_cache lets many old pools share
+    # the sorted candidate values instead of sorting them again.
+    score = nrows_old - nrows_cur
+    details = {"nrows": (nrows_old, nrows_cur)}
+
+    for colname in sorted(sets_old.keys() & sets_cur.keys()):
+        s1 = sets_old[colname]
+        s2 = sets_cur[colname]
+
+        if ((match_type == "exact" and s1 == s2) or
+                (match_type == "subset" and s1 <= s2)):
+            score += _SCOREBOARD.get(colname, 1)
+        else:
+            score -= _NO_MATCH_PENALTY.get(colname, 1)
+
+        if sorted_cache is None:
+            sorted_s2 = sorted(s2)
+        elif colname in sorted_cache:
+            sorted_s2 = sorted_cache[colname]
+        else:
+            sorted_s2 = sorted_cache[colname] = sorted(s2)
+        details[colname] = (sorted(s1), sorted_s2)
+
+    return score, details
+
+
+def _keep_match(d_scores, d_details, top_heap, top_k, i_cur, fn_cur,
+                score, details):
+    if top_k is None:
+        d_scores[fn_cur] = score
+        d_details[fn_cur] = details
+        return
+
+    # Min-heap: lowest score, then latest seen, gets evicted first.
+    item = (score, -i_cur, fn_cur, details)
+    if len(top_heap) < top_k:
+        heapq.heappush(top_heap, item)
+    else:
+        heapq.heappushpop(top_heap, item)
+
 
-    return matches
+def _find_bad_prog(fn, progs_to_ignore):
+    for bad_prog in progs_to_ignore:
+        if bad_prog in fn:
+            return bad_prog
+    return None
 
 
 def _unique_asn_cand_types(t_col):
-    rpatt_asn_cand = r", '(\w*)'"
-    output_set = set()
-    for cell in t_col:
-        m = re.findall(rpatt_asn_cand, cell)
-        if m:
-            output_set |= set(sorted(m))
-    return output_set
+    # Parse the whole column in one pass. Joining is safe because the
+    # pattern cannot match across the newline between cells.
+    return set(_RPATT_ASN_CAND.findall("\n".join(t_col)))
 
 
 def _is_cal(exptype_col):
-    # EXP_TYPE for calibration programs.
-    cal_exptype_by_ins = [
-        # FGS
-        "FGS_ACQ1", "FGS_ACQ2", "FGS_FINEGUIDE", "FGS_ID-IMAGE",
-        "FGS_ID-STACK", "FGS_TRACK",
-        # MIRI
-        "MIR_4QPM", "MIR_CORONCAL", "MIR_DARKALL", "MIR_DARKIMG",
-        "MIR_DARKMRS", "MIR_FLATIMAGE", "MIR_FLATIMAGE-EXT",
-        "MIR_FLATMRS", "MIR_FLATMRS-EXT",
-        # NIRCAM
-        "NRC_DARK", "NRC_FLAT", "NRC_FOCUS", "NRC_LED", "NRC_WFSC",
-        # NIRISS
-        "NIS_DARK", "NIS_EXTCAL", "NIS_FOCUS", "NIS_LAMP",
-        # NIRSPEC
-        "NRS_AUTOFLAT", "NRS_AUTOWAVE", "NRS_CONFIRM", "NRS_DARK",
-        "NRS_FOCUS", "NRS_IMAGE", "NRS_LAMP", "NRS_MIMF", "NRS_VERIFY"
-    ]
-
-    is_cal = False
-    for val in exptype_col:
-        if val.upper() in cal_exptype_by_ins:
-            is_cal = True
-            break
-
-    return is_cal
+    return not _CAL_EXPTYPES.isdisjoint(map(str.upper, exptype_col))
 
 
 def _get_progs_to_ignore(exptype_col, verbose=True):
@@ -0,0 +1,249 @@
+"""Long-lived local server for :mod:`poolander` with warm candidate cache.
+
+The server parses all the candidates once, keeps them in memory, and
+re-scans the candidates pattern periodically so new, changed, or
+removed pool files are picked up. Match queries are answered in JSON
+over loopback HTTP. The client side only needs the standard library,
+so scripts calling it do not pay for importing astropy.
+
+Examples
+--------
+Start the server in one terminal:
+
+.. code-block:: shell
+
+    python poolander_server.py serve "/another/path/to/jw*.csv"
+
+Then query it from another terminal:
+
+.. code-block:: shell
+
+    python poolander_server.py match /path/to/pool_002_image_miri.csv
+
+Or from Python:
+
+>>> from poolander_server import query
+>>> result = query(['/path/to/pool_002_image_miri.csv'], top_k=5)
+>>> result['scores']['/path/to/pool_002_image_miri.csv'][0]
+['/another/path/to/jw05204_20250308t202944_pool.csv', 6560]
+
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+__all__ = ["serve", "query"]
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+class _PoolanderHandler(BaseHTTPRequestHandler):
+    """``POST /match`` with JSON keywords for
+    :func:`poolander.do_match_many` and ``GET /status``."""
+
+    def do_GET(self):
+        if self.path != "/status":
+            self._send_json({"error": f"Unknown path {self.path}"}, 404)
+            return
+
+        server = self.server
+        with server.lock:
+            out = {"candidates_patt": server.candidates_patt,
+                   "n_candidates": len(server.cache),
+                   "last_refresh": server.last_refresh}
+        self._send_json(out)
+
+    def do_POST(self):
+        if self.path != "/match":
+            self._send_json({"error": f"Unknown path {self.path}"}, 404)
+            return
+
+        try:
+            nbytes = int(self.headers.get("Content-Length", 0))
+            req = json.loads(self.rfile.read(nbytes) or b"{}")
+            out = self.server.match(**req)
+        except Exception as e:  # Report back instead of killing the server
+            self._send_json({"error": f"{e.__class__.__name__}: {e}"}, 400)
+        else:
+            self._send_json(out)
+
+    def _send_json(self, out, code=200):
+        body = json.dumps(out).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class _PoolanderServer(HTTPServer):
+    """HTTP server holding the candidates cache."""
+
+    def __init__(self, address, candidates_patt, poll_interval=60,
+                 verbose=True):
+        import poolander
+
+        super().__init__(address, _PoolanderHandler)
+        self.poolander = poolander
+        self.candidates_patt = candidates_patt
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.cache = {}
+        self.last_refresh = None
+        self.refresh()
+
+        if poll_interval:
+            watcher = threading.Thread(
+                target=self._watch, args=(poll_interval, ), daemon=True)
+            watcher.start()
+
+    def refresh(self):
+        with self.lock:
+            self.poolander.warm_cache(self.candidates_patt, cache=self.cache,
+                                      verbose=self.verbose)
+            self.last_refresh = time.time()
+
+    def _watch(self, poll_interval):
+        while True:
+            time.sleep(poll_interval)
+            self.refresh()
+
+    def match(self, fn_olds, match_type="exact", max_nrows=500, top_k=None,
+              details=False):
+        if isinstance(fn_olds, str):
+            fn_olds = [fn_olds]
+
+        with self.lock:
+            d_scores, d_details = self.poolander.do_match_many(
+                fn_olds, candidates_patt=self.candidates_patt,
+                match_type=match_type, max_nrows=max_nrows, top_k=top_k,
+                cache=self.cache, verbose=False)
+
+        out = {"scores": {fn_old: score.most_common()
+                          for fn_old, score in d_scores.items()}}
+        if details:
+            out["details"] = d_details
+        return out
+
+
+def serve(candidates_patt="jw*.csv", host=DEFAULT_HOST, port=DEFAULT_PORT,
+          poll_interval=60, verbose=True):
+    """Serve match queries until interrupted.
+
+    Parameters
+    ----------
+    candidates_patt : str
+        See :func:`poolander.do_match`.
+
+    host, port : str, int
+        Address to listen on. Only use loopback unless you trust
+        everyone who can reach it.
+
+    poll_interval : float
+        Seconds between re-scans of ``candidates_patt`` for changed
+        pool files. Queries also re-parse changed candidates they touch.
+        Use 0 to disable the background re-scan.
+
+    verbose : bool
+        Print informational text.
+
+    """
+    server = _PoolanderServer((host, port), candidates_patt,
+                              poll_interval=poll_interval, verbose=verbose)
+    if verbose:
+        print(f"Serving {candidates_patt} on http://{host}:{port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        if verbose:
+            print("Shutting down server")
+    finally:
+        server.server_close()
+
+
+def query(fn_olds, match_type="exact", max_nrows=500, top_k=None,
+          details=False, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=600):
+    """Ask a running :func:`serve` for matches.
+
+    Parameters
+    ----------
+    fn_olds : str or list of str
+        Filename(s) of the CSV to be replaced, as seen by the server.
+
+    match_type, max_nrows, top_k
+        See :func:`poolander.do_match`.
+
+    details : bool
+        Also return the comparison details.
+
+    host, port : str, int
+        Address of the server.
+
+    timeout : float
+        Seconds to wait for the answer.
+
+    Returns
+    -------
+    result : dict
+        ``'scores'`` maps each old pool to a list of
+        ``[filename, score]``, best first. ``'details'`` is only there
+        if requested; tuples become lists in JSON.
+
+    """
+    req = {"fn_olds": fn_olds, "match_type": match_type,
+           "max_nrows": max_nrows, "top_k": top_k, "details": details}
+    httpreq = Request(f"http://{host}:{port}/match",
+                      data=json.dumps(req).encode(),
+                      headers={"Content-Type": "application/json"})
+    try:
+        with urlopen(httpreq, timeout=timeout) as fin:
+            return json.load(fin)
+    except HTTPError as e:
+        raise RuntimeError(json.load(e).get("error", str(e))) from None
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p_serve = subparsers.add_parser("serve", help="Start the server.")
+    p_serve.add_argument("candidates_patt")
+    p_serve.add_argument("--poll-interval", type=float, default=60)
+    p_serve.add_argument("--quiet", action="store_true")
+
+    p_match = subparsers.add_parser("match", help="Query the server.")
+    p_match.add_argument("fn_olds", nargs="+")
+    p_match.add_argument("--match-type", default="exact",
+                         choices=["exact", "subset"])
+    p_match.add_argument("--max-nrows", type=int, default=500)
+    p_match.add_argument("--top-k", type=int, default=5)
+
+    args = parser.parse_args(args)
+
+    if args.command == "serve":
+        serve(args.candidates_patt, host=args.host, port=args.port,
+              poll_interval=args.poll_interval, verbose=not args.quiet)
+    else:
+        result = query(args.fn_olds, match_type=args.match_type,
+                       max_nrows=args.max_nrows, top_k=args.top_k,
+                       host=args.host, port=args.port)
+        for fn_old, scores in result["scores"].items():
+            print(fn_old)
+            for fn_cur, score in scores:
+                print(f"  {score:6d}  {fn_cur}")
+
+
+if __name__ == "__main__":
+    main()
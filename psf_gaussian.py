@@ -7,8 +7,28 @@ Examples
 >>> psf = gauss2d(50, 2.5)
 >>> plt.imshow(psf, cmap=plt.cm.gray)
 
+Keep the PSF as its 1-D factors to smooth an image in O(N*k):
+
+>>> from psf_gaussian import gauss2d_separable
+>>> from fftconvolve import convolve2d
+>>> psf = gauss2d_separable(25, 2.5)
+>>> smoothed = convolve2d(image, psf, engine='separable')
+
+Reuse PSFs across a run, or make many at once:
+
+>>> from psf_gaussian import PSFFactory
+>>> factory = PSFFactory(maxsize=64)
+>>> psf = factory.get(25, 2.5, integrate=True)
+>>> psf = factory.get(25, (2.5, 4), theta=30, subsample=5)
+>>> psfs = factory.stack(25, [1.5, 2, 2.5, 3])
+>>> psfs.shape
+(4, 25, 25)
+
 """
 
+# STDLIB
+import functools
+
 # THIRD-PARTY
 import numpy as np
 
@@ -34,17 +54,272 @@ def gauss2d(npix, fwhm, normalize=True):
         Gaussian point spread function.
 
     """
-    # Initialize PSF params
-    cntrd = (npix - 1.0) * 0.5
+    return gauss2d_separable(npix, fwhm, normalize=normalize).to_array()
+
+
+def gauss2d_separable(npix, fwhm, normalize=True):
+    """
+    Like :func:`gauss2d` but keep the PSF as its 1-D factors.
+
+    A Gaussian without rotation is the outer product of two 1-D
+    Gaussians, so ``exp`` is only evaluated ``2 * npix`` times.
+
+    Parameters
+    ----------
+    npix : int
+        Number of pixels for each dimension.
+
+    fwhm : float or tuple of float
+        FWHM (pixels). Single number to make all the same,
+        or ``(fwhm_y, fwhm_x)``.
+
+    normalize : bool, optional
+        Normalized so total PSF is 1.
+
+    Returns
+    -------
+    psf : `SeparablePSF`
+        Gaussian point spread function.
+
+    """
+    fwhm_y, fwhm_x = np.broadcast_to(fwhm, 2)
+    return SeparablePSF(gauss1d(npix, fwhm_y, normalize=normalize),
+                        gauss1d(npix, fwhm_x, normalize=normalize))
+
+
+def gauss1d(npix, fwhm, normalize=True):
+    """
+    Parameters
+    ----------
+    npix : int
+        Number of pixels.
+
+    fwhm : float
+        FWHM (pixels).
+
+    normalize : bool, optional
+        Normalized so total is 1.
+
+    Returns
+    -------
+    psf : array_like
+        1-D Gaussian, centered like :func:`gauss2d`.
+
+    """
     st_dev = 0.5 * fwhm / np.sqrt(2.0 * np.log(2))
 
-    # Make PSF (Rene Breton 2011-10-20)
+    # Make PSF (Rene Breton 2011-10-20), one axis at a time.
     # https://groups.google.com/group/astropy-dev/browse_thread/thread/5ee6cd662236e382
-    x, y = np.indices([npix, npix]) - (npix - 1) * 0.5
-    psf = np.exp(-0.5 * ((x**2 + y**2) / st_dev**2))
+    x = np.arange(npix) - (npix - 1) * 0.5
+    psf = np.exp(-0.5 * (x / st_dev)**2)
 
-    # Normalize
     if normalize:
         psf /= psf.sum()
 
     return psf
+
+
+def gauss2d_stack(npix, fwhms, normalize=True, subsample=1, integrate=False,
+                  theta=0.0):
+    """
+    Gaussian PSFs for many FWHMs in one vectorized evaluation.
+
+    Parameters
+    ----------
+    npix : int
+        Number of pixels for each dimension.
+
+    fwhms : array_like
+        FWHM (pixels) of each PSF, shape ``(n, )``, or
+        ``(fwhm_y, fwhm_x)`` of each PSF, shape ``(n, 2)``.
+        For elliptical PSFs, these are along the axes before rotation.
+
+    normalize : bool, optional
+        Normalized so total of each PSF is 1.
+
+    subsample : int, optional
+        Average ``subsample x subsample`` samples in each pixel
+        instead of sampling pixel centers only.
+
+    integrate : bool, optional
+        Integrate exactly over each pixel, using ``erf``.
+        Only for PSFs without rotation. Cannot be used with
+        ``subsample``.
+
+    theta : float, optional
+        Rotation (degrees) counterclockwise from X. Only matters for
+        elliptical PSFs.
+
+    Returns
+    -------
+    psfs : array_like
+        Stack of Gaussian PSFs with shape ``(n, npix, npix)``.
+
+    """
+    fwhms = np.asarray(fwhms, dtype=float)
+    if fwhms.ndim == 1:
+        fwhms = np.stack([fwhms, fwhms], axis=-1)
+    st_y, st_x = (0.5 * fwhms / np.sqrt(2.0 * np.log(2))).T
+
+    subsample = int(subsample)
+    if integrate and subsample != 1:
+        raise ValueError('integrate and subsample cannot be used together')
+
+    rotated = theta % 180 != 0 and np.any(st_y != st_x)
+    if rotated:
+        if integrate:
+            raise ValueError('integrate is not available for rotated '
+                             'elliptical PSF; use subsample instead')
+        psfs = _gauss_rotated(npix, st_y, st_x, np.deg2rad(theta),
+                              subsample)
+    else:
+        psfs = (_gauss_factor(npix, st_y, subsample, integrate)[:, :, None] *
+                _gauss_factor(npix, st_x, subsample, integrate)[:, None, :])
+
+    if normalize:
+        psfs /= psfs.sum(axis=(1, 2), keepdims=True)
+
+    return psfs
+
+
+class PSFFactory(object):
+    """
+    Gaussian PSFs memoized by their parameters with an LRU bound.
+
+    Returned PSFs are read-only because they are shared between calls;
+    copy them before changing them in-place.
+
+    Parameters
+    ----------
+    maxsize : int or `None`
+        Maximum number of PSFs kept. If `None`, no limit.
+
+    """
+    def __init__(self, maxsize=128):
+        self._cached = functools.lru_cache(maxsize=maxsize)(self._make)
+
+    def get(self, npix, fwhm, normalize=True, subsample=1, integrate=False,
+            theta=0.0):
+        """
+        Parameters
+        ----------
+        npix : int
+            Number of pixels for each dimension.
+
+        fwhm : float or tuple of float
+            FWHM (pixels). Single number to make all the same,
+            or ``(fwhm_y, fwhm_x)`` before rotation.
+
+        normalize, subsample, integrate, theta
+            See :func:`gauss2d_stack`.
+
+        Returns
+        -------
+        psf : array_like
+            Read-only Gaussian point spread function.
+
+        """
+        fwhm_y, fwhm_x = (float(f) for f in np.broadcast_to(fwhm, 2))
+        theta = float(theta) % 180 if fwhm_y != fwhm_x else 0.0
+        return self._cached(int(npix), fwhm_y, fwhm_x, bool(normalize),
+                            int(subsample), bool(integrate), theta)
+
+    def stack(self, npix, fwhms, normalize=True, subsample=1,
+              integrate=False, theta=0.0):
+        """Not memoized. See :func:`gauss2d_stack`."""
+        return gauss2d_stack(npix, fwhms, normalize=normalize,
+                             subsample=subsample, integrate=integrate,
+                             theta=theta)
+
+    def cache_info(self):
+        """Hits, misses, and size of the cache."""
+        return self._cached.cache_info()
+
+    def cache_clear(self):
+        """Forget all the PSFs."""
+        self._cached.cache_clear()
+
+    @staticmethod
+    def _make(npix, fwhm_y, fwhm_x, normalize, subsample, integrate, theta):
+        psf = gauss2d_stack(npix, [(fwhm_y, fwhm_x)], normalize=normalize,
+                            subsample=subsample, integrate=integrate,
+                            theta=theta)[0]
+        psf.setflags(write=False)
+        return psf
+
+
+class SeparablePSF(object):
+    """
+    PSF that is the outer product of 1-D Y and X factors.
+
+    Convolution code can use the ``factors`` directly (see
+    ``fftconvolve.convolve2d``); anything else gets the full 2-D array
+    through `numpy.asarray`.
+
+    Parameters
+    ----------
+    yfactor, xfactor : array_like
+        1-D factors along Y and X.
+
+    """
+    def __init__(self, yfactor, xfactor):
+        self.factors = (np.asarray(yfactor), np.asarray(xfactor))
+
+    @property
+    def shape(self):
+        return tuple(len(f) for f in self.factors)
+
+    @property
+    def ndim(self):
+        return 2
+
+    def to_array(self):
+        """Full 2-D PSF."""
+        return np.outer(*self.factors)
+
+    def __array__(self, dtype=None, copy=None):
+        psf = self.to_array()
+        if dtype is not None:
+            psf = psf.astype(dtype, copy=False)
+        return psf
+
+    def __repr__(self):
+        return '<SeparablePSF shape={}>'.format(self.shape)
+
+
+def _gauss_factor(npix, st_dev, subsample=1, integrate=False):
+    # Peak-1 1-D Gaussians for each st_dev, shape (n, npix).
+    st_dev = np.asarray(st_dev, dtype=float)[:, None]
+
+    if integrate:
+        from scipy.special import erf
+
+        edges = np.arange(npix + 1) - npix * 0.5
+        cdf = erf(edges / (np.sqrt(2.0) * st_dev))
+        return np.sqrt(0.5 * np.pi) * st_dev * np.diff(cdf, axis=-1)
+
+    x = _sample_coords(npix, subsample)
+    psf = np.exp(-0.5 * (x / st_dev)**2)
+    return psf.reshape(len(st_dev), npix, subsample).mean(axis=-1)
+
+
+def _gauss_rotated(npix, st_y, st_x, theta, subsample=1):
+    # Peak-1 rotated elliptical Gaussians, shape (n, npix, npix).
+    c = _sample_coords(npix, subsample)
+    y = c[:, None]
+    x = c[None, :]
+    xr = x * np.cos(theta) + y * np.sin(theta)
+    yr = -x * np.sin(theta) + y * np.cos(theta)
+
+    st_y = np.asarray(st_y, dtype=float)[:, None, None]
+    st_x = np.asarray(st_x, dtype=float)[:, None, None]
+    psf = np.exp(-0.5 * ((xr / st_x)**2 + (yr / st_y)**2))
+
+    n = len(st_y)
+    return psf.reshape(n, npix, subsample, npix, subsample).mean(axis=(2, 4))
+
+
+def _sample_coords(npix, subsample=1):
+    # Sample positions relative to PSF center, subsample per pixel.
+    offsets = (np.arange(subsample) + 0.5) / subsample - 0.5
+    return (np.arange(npix)[:, None] + offsets).ravel() - (npix - 1) * 0.5